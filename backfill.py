@@ -0,0 +1,244 @@
+"""
+Backfill of the commit comments of past pushes, e.g. after an outage.
+
+Instead of sending a command per comment, the comments are grouped by
+project and issue and added in batches of BACKFILL_BATCH_SIZE issues through
+the import API: every issue is imported again with its current fields and
+comments plus the new ones. Comments that an issue already has are not added
+again. A batch that YouTrack rejects is split in halves until the issues
+that fail are found (see Connection.importIssuesInBatches).
+
+Usage:
+
+    python backfill.py payloads FILE_OR_DIRECTORY...
+    python backfill.py git REPOSITORY REVISIONS --name NAME --url URL --homepage URL [--ref REF]
+
+The first reads saved webhook payloads (JSON files), the second the commits
+in a revision range (e.g. "v1.0..master") of a local git repository.
+"""
+
+import argparse
+import calendar
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import dateutil.parser
+from youtrack import YouTrackException
+import githook
+from githook import app
+from mirror import read_commits
+
+
+class Backfill(object):
+    """Posts the comments of a list of push events through the import API."""
+
+    def __init__(self, yt, batch_size, threads, logger):
+        self.yt = yt
+        self.batch_size = batch_size
+        self.threads = threads
+        self.logger = logger
+        self.stats = dict.fromkeys(['commits', 'references', 'issues', 'missing_issues', 'comments', 'duplicates',
+                                    'batches', 'failed_issues', 'requests'], 0)
+        self._lock = threading.Lock()
+        yt.listeners.append(self._count_request)
+
+    def _count_request(self, method, url, status, seconds, size):
+        with self._lock:
+            self.stats['requests'] += 1
+
+    def run(self, push_events):
+        started = time.time()
+        # project -> issue id -> [(push event, commit)], in push order
+        projects = OrderedDict()
+        for push_event in push_events:
+            for commit in push_event['commits']:
+                self.stats['commits'] += 1
+                for issue_id in githook.issue_extractor.extract(commit['message']):
+                    if githook.posted_index is not None and githook.posted_index.contains(commit['id'], issue_id):
+                        continue
+                    self.stats['references'] += 1
+                    issues = projects.setdefault(issue_id.rsplit('-', 1)[0], OrderedDict())
+                    issues.setdefault(issue_id, []).append((push_event, commit))
+        emails = set(commit['author']['email'] for issues in projects.values() for references in issues.values()
+                     for push_event, commit in references)
+        user_logins = githook.resolve_authors(self.yt, list(emails))
+
+        for project, issues in projects.items():
+            issue_ids = issues.keys()
+            for i in range(0, len(issue_ids), self.batch_size):
+                batch = issue_ids[i:i + self.batch_size]
+                self._import_batch(project, [(issue_id, issues[issue_id]) for issue_id in batch], user_logins)
+                self.stats['batches'] += 1
+                elapsed = time.time() - started
+                self.logger.info('%s: %d of %d issues, %d comments so far (%.1f comments/s)', project,
+                                 min(i + self.batch_size, len(issue_ids)), len(issue_ids), self.stats['comments'],
+                                 self.stats['comments'] / elapsed if elapsed else 0)
+        self.stats['seconds'] = time.time() - started
+        return self.stats
+
+    def _import_batch(self, project, references, user_logins):
+        def load(item):
+            issue_id, issue_references = item
+            try:
+                issue = self.yt.getIssue(issue_id)
+                issue.getComments()
+            except YouTrackException, e:
+                if e.response.status != 404:
+                    raise
+                return None
+            return issue, issue_references
+        loaded = githook.parallel_map(load, references, self.threads)
+
+        issues = []
+        posted = []
+        for item, (issue_id, issue_references) in zip(loaded, references):
+            if item is None:
+                self.logger.warn("Couldn't find issue %s", issue_id)
+                self.stats['missing_issues'] += 1
+                continue
+            issue, issue_references = item
+            comments = new_comments(issue, issue_references, user_logins)
+            self.stats['duplicates'] += sum(len(commits) for commits, comment in comments if comment is None)
+            comments = [(commits, comment) for commits, comment in comments if comment is not None]
+            if not comments:
+                continue
+            # the import replaces the comments of the issue, so the existing
+            # ones are sent along with the new ones
+            issue.comments = [existing_comment(comment) for comment in issue.comments] + \
+                [comment for commits, comment in comments]
+            issues.append(issue)
+            posted.append((issue_id, comments))
+        self.stats['issues'] += len(issues)
+
+        failed = set(self._import(project, issues))
+        for issue_id, comments in posted:
+            if issue_id in failed:
+                continue
+            self.stats['comments'] += len(comments)
+            if githook.posted_index is not None:
+                for commits, comment in comments:
+                    for commit in commits:
+                        githook.posted_index.add(commit['id'], issue_id)
+
+    def _import(self, project, issues):
+        """Import the issues and return the ids of those that couldn't be
+        imported.
+        """
+        if not issues:
+            return []
+        failed = []
+        results = self.yt.importIssuesInBatches(project, None, issues, max_issues=self.batch_size, threads=1)
+        for issue, result in zip(issues, results):
+            if not result.imported:
+                self.logger.error("Couldn't import issue %s: %s", issue.id, result.reason)
+                self.stats['failed_issues'] += 1
+                failed.append(issue.id)
+        return failed
+
+
+def new_comments(issue, references, user_logins):
+    """Return `(commits, comment)` pairs for the comments to add to an issue,
+    where comment is `None` if the issue already has the comment.
+    """
+    existing = set(comment.text for comment in issue.comments)
+    # consecutive references from the same push are commented together
+    pushes = []
+    for push_event, commit in references:
+        if pushes and pushes[-1][0] is push_event:
+            pushes[-1][1].append(commit)
+        else:
+            pushes.append((push_event, [commit]))
+    comments = []
+    for push_event, commits in pushes:
+        for group in githook.group_commits(push_event, commits, user_logins):
+            text = githook.format_comment(push_event, group)
+            if text in existing:
+                comments.append((group, None))
+                continue
+            created = dateutil.parser.parse(group[-1]['timestamp'])
+            comments.append((group, {'author': user_logins[group[0]['author']['email']],
+                                     'text': text,
+                                     'created': str(calendar.timegm(created.utctimetuple()) * 1000)}))
+    return comments
+
+
+def existing_comment(comment):
+    """Return the attributes of a comment of an issue that the import API
+    accepts.
+    """
+    return dict((name, comment[name]) for name in ('author', 'text', 'created', 'updated')
+                if getattr(comment, name, None) is not None)
+
+
+def load_payloads(paths):
+    """Read the push events saved in the given files and directories (every
+    *.json file in them), in order of their names.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.json'))))
+        else:
+            files.append(path)
+    push_events = []
+    for name in files:
+        with open(name) as f:
+            push_event = json.load(f)
+        if not githook.is_push_event(push_event):
+            app.logger.warn('Skipping %s, it is not a push event', name)
+            continue
+        push_events.append(push_event)
+    return push_events
+
+
+def load_git_history(path, revisions, name, url, homepage, ref):
+    """Return a push event of the commits in a revision range of a git
+    repository.
+    """
+    return {'ref': ref,
+            'user_name': 'backfill',
+            'repository': {'name': name, 'url': url, 'homepage': homepage},
+            'commits': read_commits(path, revisions, homepage.rstrip('/') + '/commit/')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Post the comments of past pushes through the YouTrack import API.')
+    parser.add_argument('--batch-size', type=int, default=app.config['BACKFILL_BATCH_SIZE'],
+                        help='issues imported per request')
+    commands = parser.add_subparsers(dest='source')
+    payloads = commands.add_parser('payloads', help='read saved webhook payloads')
+    payloads.add_argument('paths', nargs='+', metavar='FILE_OR_DIRECTORY')
+    git = commands.add_parser('git', help='read the history of a git repository')
+    git.add_argument('repository')
+    git.add_argument('revisions')
+    git.add_argument('--name', required=True, help='name of the repository in comments')
+    git.add_argument('--url', required=True, help='url of the repository')
+    git.add_argument('--homepage', required=True, help='web page of the repository, commits are at HOMEPAGE/commit/ID')
+    git.add_argument('--ref', default='refs/heads/master', help='branch named in comments')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.source == 'payloads':
+        push_events = load_payloads(args.paths)
+    else:
+        push_events = [load_git_history(args.repository, args.revisions, args.name, args.url, args.homepage,
+                                        args.ref)]
+
+    backfill = Backfill(githook.get_connection(), args.batch_size, app.config['COMMENT_THREADS'], app.logger)
+    stats = backfill.run(push_events)
+    print ('%(commits)d commits, %(references)d references: %(comments)d comments added to %(issues)d issues in '
+           '%(batches)d batches, %(duplicates)d already posted, %(missing_issues)d missing and %(failed_issues)d '
+           'failed issues' % stats)
+    print '%d requests in %.1f s: %.1f comments/s, %.1f commits/s' % (
+        stats['requests'], stats['seconds'], stats['comments'] / stats['seconds'] if stats['seconds'] else 0,
+        stats['commits'] / stats['seconds'] if stats['seconds'] else 0)
+    return 1 if stats['failed_issues'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
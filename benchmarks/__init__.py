@@ -0,0 +1,4 @@
+"""
+Benchmarks of the hook, run from the root of the repository, e.g.
+`python -m benchmarks.load --help`.
+"""
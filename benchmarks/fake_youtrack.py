@@ -0,0 +1,151 @@
+"""
+A local stand-in for YouTrack, answering the requests the hook sends with
+configurable latency and errors.
+"""
+
+import BaseHTTPServer
+import random
+import re
+import SocketServer
+import threading
+import time
+import urlparse
+from collections import Counter
+from xml.sax.saxutils import quoteattr
+
+
+class FakeYouTrack(object):
+    """Serves the REST endpoints used by the hook on a local port:
+
+    - POST /rest/user/login
+    - GET /rest/admin/user (search by `q`, pages of ten)
+    - GET /rest/admin/user/{login}
+    - GET /rest/project/all
+    - GET /rest/issue/{id}
+    - POST /rest/issue/{id}/execute
+
+    There are `users` users, "user{n}" with the address user{n}@example.com,
+    and the issues 1 to `issues` of each of `projects` ("PROJ", then "PROJ1",
+    "PROJ2"...). Every response is delayed by `latency` plus up to `jitter`
+    seconds, and fails with `error_status` at the rate `error_rate`
+    (except the login). The requests served are counted by method and path,
+    with the ids replaced by placeholders, in `calls`.
+    """
+
+    def __init__(self, users=100, projects=1, issues=10000, latency=0, jitter=0, error_rate=0, error_status=503):
+        self.users = users
+        self.projects = [project_name(i) for i in range(projects)]
+        self.issues = issues
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._server.server_address
+
+    def start(self, port=0):
+        """Start serving on a thread of its own; returns the base url."""
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.youtrack = self
+        thread = threading.Thread(target=self._server.serve_forever, name='fake-youtrack')
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def _count(self, method, path):
+        path = re.sub(r'^/rest/issue/[^/]+', '/rest/issue/{id}', path)
+        path = re.sub(r'^/rest/admin/user/[^/]+', '/rest/admin/user/{login}', path)
+        with self._lock:
+            self.calls[method + ' ' + path] += 1
+
+    def answer(self, method, path, query, authenticated):
+        """Return `(status, body, headers)` for a request."""
+        self._count(method, path)
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if path == '/rest/user/login' and method == 'POST':
+            return 200, '<login>ok</login>', {'Set-Cookie': 'JSESSIONID=fake; Path=/'}
+        if not authenticated:
+            return 401, '<error>Unauthorized.</error>', {}
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, '<error>Injected failure.</error>', {}
+
+        if path.rstrip('/') == '/rest/admin/user' and method == 'GET':
+            q = query.get('q', [''])[0]
+            start = int(query.get('start', ['0'])[0])
+            logins = [login for login, email in self._users() if q in login or q in email][start:start + 10]
+            return 200, '<userRefs>%s</userRefs>' % ''.join(
+                '<user login=%s url=%s/>' % (quoteattr(login), quoteattr(self.url + '/rest/admin/user/' + login))
+                for login in logins), {}
+        match = re.match(r'/rest/admin/user/user(\d+)$', path)
+        if match and method == 'GET' and int(match.group(1)) < self.users:
+            login = 'user' + match.group(1)
+            return 200, '<user login=%s email=%s fullName=%s/>' % (
+                quoteattr(login), quoteattr(login + '@example.com'), quoteattr('User ' + match.group(1))), {}
+        if path == '/rest/project/all' and method == 'GET':
+            return 200, '<projects>%s</projects>' % ''.join(
+                '<project name=%s shortName=%s/>' % (quoteattr(name), quoteattr(name)) for name in self.projects), {}
+        match = re.match(r'/rest/issue/([A-Z0-9]+)-(\d+)(/execute)?$', path)
+        if match and match.group(1) in self.projects and 0 < int(match.group(2)) <= self.issues:
+            if match.group(3) and method == 'POST':
+                return 200, '', {}
+            if not match.group(3) and method == 'GET':
+                return 200, ('<issue id="%s-%s"><field name="summary"><value>Issue %s</value></field>'
+                             '<field name="numberInProject"><value>%s</value></field></issue>' %
+                             (match.group(1), match.group(2), match.group(2), match.group(2))), {}
+        return 404, '<error>Not found.</error>', {}
+
+    def _users(self):
+        return [('user%d' % i, 'user%d@example.com' % i) for i in range(self.users)]
+
+
+def project_name(i):
+    return 'PROJ%d' % i if i else 'PROJ'
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        url = urlparse.urlparse(self.path)
+        authenticated = 'JSESSIONID=fake' in (self.headers.get('Cookie') or '') or 'X-YouTrack-ApiKey' in self.headers
+        status, body, headers = self.server.youtrack.answer(self.command, url.path, urlparse.parse_qs(url.query),
+                                                            authenticated)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
@@ -0,0 +1,249 @@
+"""
+Load test of the hook: sends synthetic push events at a target rate to the
+Flask application, backed by a local fake YouTrack, and reports the latency
+of the webhook requests, the rate they were handled at and the number of
+requests sent to YouTrack per commit.
+
+    python -m benchmarks.load --events 500 --rate 50 --commits 5 --references 2 --latency 0.02
+
+The push events are made from a template payload (fixtures/01.json by
+default): every event gets `--commits` commits, spread over `--repositories`
+repositories, each commit referencing `--references` issues. Settings of the
+hook can be overridden with `--set NAME=VALUE` (VALUE is a Python literal),
+e.g. `--set ASYNC_PROCESSING=True` or `--set YOUTRACK_COMMAND_RATE=20`.
+
+With a target rate, latency is measured from the time a request was scheduled
+to be sent, so that requests delayed by slow earlier ones are not left out of
+the numbers.
+"""
+
+import argparse
+import ast
+import copy
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from Queue import Queue
+
+from benchmarks.fake_youtrack import FakeYouTrack, project_name
+
+
+class PushEventFactory(object):
+    """Makes push events from a template payload. Commit ids are unique across
+    all events; commits are authored by the users of the fake YouTrack, or by
+    unknown addresses at the rate `unknown_authors`.
+    """
+
+    def __init__(self, template, commits, references, repositories=1, projects=1, issues=10000, users=100,
+                 unknown_authors=0, seed=0):
+        self.template = template
+        self.commits = commits
+        self.references = references
+        self.repositories = repositories
+        self.projects = projects
+        self.issues = issues
+        self.users = users
+        self.unknown_authors = unknown_authors
+        self._random = random.Random(seed)
+        self._count = 0
+
+    def make(self):
+        push_event = copy.deepcopy(self.template)
+        n = self._count
+        self._count += 1
+        repository = n % self.repositories
+        push_event['repository'] = dict(push_event['repository'], name='repo%d' % repository,
+                                        url='localhost/repo%d' % repository,
+                                        homepage='http://localhost/repo%d' % repository)
+        commit_template = self.template['commits'][-1]
+        push_event['commits'] = [self._commit(commit_template, push_event['repository'], n, i)
+                                 for i in range(self.commits)]
+        push_event['before'] = hashlib.sha1('before %d' % n).hexdigest()
+        push_event['after'] = push_event['commits'][-1]['id'] if push_event['commits'] else push_event['before']
+        push_event['total_commits_count'] = len(push_event['commits'])
+        return push_event
+
+    def _commit(self, template, repository, n, i):
+        sha = hashlib.sha1('commit %d %d' % (n, i)).hexdigest()
+        issues = ['%s-%d' % (project_name(self._random.randrange(self.projects)),
+                             self._random.randint(1, self.issues)) for _ in range(self.references)]
+        if self._random.random() < self.unknown_authors:
+            author = {'name': 'Unknown %d' % n, 'email': 'unknown%d@example.org' % n}
+        else:
+            user = self._random.randrange(self.users)
+            author = {'name': 'User %d' % user, 'email': 'user%d@example.com' % user}
+        return dict(template, id=sha, url='%s/commit/%s' % (repository['homepage'], sha), author=author,
+                    message='Change %d of push %d%s' % (i, n, ', refs ' + ' '.join(issues) if issues else ''))
+
+
+def percentile(values, p):
+    """The nearest-rank percentile of sorted values."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))]
+
+
+def run(app, factory, events, rate, concurrency, youtrack, drain=None):
+    """Send `events` push events to the application at `rate` per second (as
+    fast as possible if 0) from `concurrency` threads, and return the results.
+    `drain` is called after the last response, to wait for queued work.
+    """
+    payloads = [json.dumps(factory.make()) for _ in range(events)]
+    commits = events * factory.commits
+    queue = Queue(maxsize=concurrency * 2)
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def send():
+        client = app.test_client()
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            scheduled, payload = item
+            if scheduled is None:
+                scheduled = time.time()
+            response = client.post('/push_event', data=payload, content_type='application/json')
+            latency = time.time() - scheduled
+            with lock:
+                latencies.append(latency)
+                statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target=send, name='load-%d' % i) for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    youtrack.reset()
+    started = time.time()
+    for i, payload in enumerate(payloads):
+        scheduled = None
+        if rate:
+            scheduled = started + i / float(rate)
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        queue.put((scheduled, payload))
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    answered = time.time()
+    if drain is not None:
+        drain()
+    finished = time.time()
+
+    latencies.sort()
+    calls = youtrack.total_calls()
+    return {'events': events,
+            'commits': commits,
+            'seconds': answered - started,
+            'drain_seconds': finished - answered,
+            'requests_per_second': events / (answered - started),
+            'commits_per_second': commits / (finished - started),
+            'latency': dict(('p%d' % p, percentile(latencies, p)) for p in (50, 95, 99)),
+            'latency_max': latencies[-1] if latencies else 0,
+            'statuses': dict((str(status), count) for status, count in statuses.items()),
+            'youtrack_calls': calls,
+            'youtrack_calls_per_commit': calls / float(commits) if commits else 0,
+            'youtrack_endpoints': dict(youtrack.calls)}
+
+
+def report(results, out=sys.stdout):
+    out.write('%(events)d push events, %(commits)d commits in %(seconds).2f s' % results)
+    if results['drain_seconds'] >= 0.01:
+        out.write(' (+%(drain_seconds).2f s to process the queued events)' % results)
+    out.write('\n')
+    out.write('requests/s: %(requests_per_second).1f, commits/s: %(commits_per_second).1f\n' % results)
+    out.write('latency: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, max %.1f ms\n' % (
+        results['latency']['p50'] * 1000, results['latency']['p95'] * 1000, results['latency']['p99'] * 1000,
+        results['latency_max'] * 1000))
+    out.write('responses: %s\n' % ', '.join('%s: %d' % item for item in sorted(results['statuses'].items())))
+    out.write('YouTrack calls: %(youtrack_calls)d, %(youtrack_calls_per_commit).2f per commit\n' % results)
+    for endpoint, count in sorted(results['youtrack_endpoints'].items(), key=lambda item: -item[1]):
+        out.write('    %6d  %s\n' % (count, endpoint))
+
+
+def parse_setting(setting):
+    name, _, value = setting.partition('=')
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the hook against a fake YouTrack.')
+    parser.add_argument('--events', type=int, default=200, help='push events to send')
+    parser.add_argument('--rate', type=float, default=0, help='push events per second, 0 for as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests sent at once')
+    parser.add_argument('--warmup', type=int, default=10, help='push events sent before measuring')
+    parser.add_argument('--template', default='fixtures/01.json', help='payload the push events are made from')
+    parser.add_argument('--commits', type=int, default=3, help='commits per push event')
+    parser.add_argument('--references', type=int, default=1, help='issue references per commit')
+    parser.add_argument('--repositories', type=int, default=4)
+    parser.add_argument('--projects', type=int, default=1)
+    parser.add_argument('--issues', type=int, default=10000, help='issues per project')
+    parser.add_argument('--missing-issues', type=float, default=0,
+                        help='share of references to issues that do not exist')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--unknown-authors', type=float, default=0, help='share of commits by unknown authors')
+    parser.add_argument('--latency', type=float, default=0, help='seconds YouTrack takes to answer')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra seconds YouTrack takes to answer')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of YouTrack requests that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a setting of the hook')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    with open(args.template) as f:
+        template = json.load(f)
+    youtrack = FakeYouTrack(args.users, args.projects, args.issues, args.latency, args.jitter, args.error_rate,
+                            args.error_status)
+    youtrack.start()
+
+    # the hook reads its settings on import
+    settings = {'YOUTRACK_URL': youtrack.url, 'YOUTRACK_USERNAME': 'bench', 'YOUTRACK_PASSWORD': 'bench',
+                'YOUTRACK_APIKEY': '', 'DEFAULT_USER': 'user0', 'SPOOL_PATH': '', 'DEDUP_PATH': '',
+                'USER_DIRECTORY': False, 'RETRY_AFTER': 1}
+    settings.update(parse_setting(setting) for setting in args.settings)
+    handle, path = tempfile.mkstemp(suffix='.cfg')
+    with os.fdopen(handle, 'w') as f:
+        for name, value in settings.items():
+            f.write('%s = %r\n' % (name, value))
+    os.environ['GITHOOK_SETTINGS'] = path
+    try:
+        import githook
+    finally:
+        os.remove(path)
+    githook.app.logger.disabled = True
+
+    # references to missing issues point past the last issue of a project
+    issues = int(args.issues / (1 - args.missing_issues)) if args.missing_issues < 1 else args.issues * 2
+    factory = PushEventFactory(template, args.commits, args.references, args.repositories, args.projects, issues,
+                               args.users, args.unknown_authors, args.seed)
+    if args.warmup:
+        run(githook.app, factory, args.warmup, 0, args.concurrency, youtrack, githook.worker_pool.join)
+    results = run(githook.app, factory, args.events, args.rate, args.concurrency, youtrack,
+                  githook.worker_pool.join)
+    results['settings'] = dict((name, settings[name]) for name in settings if name != 'YOUTRACK_URL')
+    results['arguments'] = vars(args)
+    if args.json:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        report(results)
+    youtrack.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the CPU-bound paths of the youtrack library: building
+objects from the XML responses and serializing the XML of the import
+requests.
+
+    python -m benchmarks.micro --output before.json
+    python -m benchmarks.micro --compare before.json
+
+The XML inputs are made from the records (an issue, a user, a value of a
+bundle) recorded in fixtures/xml, repeated as often as needed for documents
+of about 1, 1000 and 100000 XML elements (see `--sizes`); the inputs of the
+import requests likewise make request bodies of that many elements. Every
+case is run in a child process of its own, several times until `--min-time`
+seconds have passed, and reports:
+
+- the fastest and the median time of a run,
+- the growth of the peak resident memory of the process during a run,
+- the number of objects tracked by the garbage collector that the result
+  keeps alive, and, where the tracemalloc module is available (Python 3 or
+  the pytracemalloc backport), the peak of the memory allocated by a run,
+- for the import requests, a checksum of the request body, so that changes
+  of the serialization show up when comparing results.
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from xml.dom import minidom
+
+import httplib2
+
+import youtrack
+from youtrack.connection import Connection
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'fixtures', 'xml')
+
+
+def fixture(name, records, root):
+    """Return a document of copies of a recorded element, numbered from 1 to
+    `records`, inside the given root element.
+    """
+    with open(os.path.join(FIXTURES, name)) as f:
+        template = f.read().strip()
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n', root[0]]
+    parts.extend(template.replace('{n}', str(n)) for n in range(1, records + 1))
+    parts.append(root[1])
+    return '\n'.join(parts)
+
+
+class OfflineConnection(Connection):
+    """A connection that answers every request with a canned response,
+    remembering the last request body.
+    """
+
+    def __init__(self, response='<importResult/>'):
+        self.url = 'http://localhost'
+        self.baseUrl = self.url + '/rest'
+        self.headers = {}
+        self._credentials = None
+        self.listeners = []
+        self.response = response
+        self.body = None
+
+    def _req(self, method, url, body=None, ignoreStatus=None):
+        if callable(body):
+            # a function returning the body in chunks
+            body = ''.join(body())
+        self.body = body or ''
+        return httplib2.Response({'status': 200, 'content-type': 'application/xml'}), self.response
+
+    def getProjectTimeTrackingSettings(self, projectId):
+        return None
+
+
+def import_issues(records):
+    issues = []
+    for n in range(1, records + 1):
+        issue = youtrack.Issue()
+        issue.numberInProject = str(n)
+        issue.summary = u'Import of issue %d fails when the description contains <markup>' % n
+        issue.description = u'Steps to reproduce:\n1. Create an issue with "quotes" & <tags>\n2. Export it ✓'
+        issue.created = '1267030230127'
+        issue.reporterName = 'root'
+        issue.Priority = 'Normal'
+        issue.State = 'Open'
+        issue.Assignee = 'user%d' % n
+        issue.fixedVersion = ['1.0', '2.0']
+        issue.comments = [{'author': 'root', 'text': u'Confirmed on 2.0 & later ✓', 'created': '1267030230127'}]
+        issues.append(issue)
+    return issues
+
+
+def import_users(records):
+    return [{'login': 'user%d' % n, 'fullName': u'User %d ✓' % n, 'email': 'user%d@example.com' % n,
+             'jabber': 'user%d@jabber.example.com' % n} for n in range(1, records + 1)]
+
+
+def import_links(records):
+    return [{'typeName': 'Depend', 'source': 'BENCH-%d' % n, 'target': 'BENCH-%d' % (n + 1),
+             'typeOutward': 'depends on', 'typeInward': 'is required for'} for n in range(1, records + 1)]
+
+
+def _elements(document, tag):
+    return [e for e in document.documentElement.childNodes if e.nodeType == e.ELEMENT_NODE and e.tagName == tag]
+
+
+def _import(call):
+    yt = OfflineConnection()
+    # importIssues reports every issue on the standard streams
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = sys.stderr = devnull
+        try:
+            call(yt)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+    return yt
+
+
+def _issues_xml(records):
+    return fixture('issue.xml', records, ('<issues>', '</issues>'))
+
+
+def _users_xml(records):
+    return fixture('user.xml', records, ('<users>', '</users>'))
+
+
+def _bundle_xml(records):
+    return fixture('enum-value.xml', records, ('<enumeration name="Bench">', '</enumeration>'))
+
+
+# name -> (setup(records) returning the input of a run, run(input) returning
+# the result, document(records) returning the XML the case reads or writes)
+CASES = OrderedDict([
+    ('parse.issues', (_issues_xml, minidom.parseString, _issues_xml)),
+    ('objects.issues', (lambda records: _elements(minidom.parseString(_issues_xml(records)), 'issue'),
+                        lambda elements: [youtrack.Issue(e, None) for e in elements], _issues_xml)),
+    ('objects.users', (lambda records: _elements(minidom.parseString(_users_xml(records)), 'user'),
+                       lambda elements: [youtrack.User(e, None) for e in elements], _users_xml)),
+    ('objects.bundle', (lambda records: minidom.parseString(_bundle_xml(records)),
+                        lambda document: youtrack.EnumBundle(document, None), _bundle_xml)),
+    ('import.issues', (import_issues, lambda issues: _import(lambda yt: yt.importIssues('BENCH', 'users', issues)),
+                       lambda records: _import(lambda yt: yt.importIssues('BENCH', 'users',
+                                                                          import_issues(records))).body)),
+    ('import.users', (import_users, lambda users: _import(lambda yt: yt.importUsers(users)),
+                      lambda records: _import(lambda yt: yt.importUsers(import_users(records))).body)),
+    ('import.links', (import_links, lambda links: _import(lambda yt: yt.importLinks(links)),
+                      lambda records: _import(lambda yt: yt.importLinks(import_links(records))).body)),
+])
+
+
+def records_for(name, size):
+    """The number of records (issues, users...) of a case making up about
+    `size` XML elements, at least one.
+    """
+    document = CASES[name][2](1)
+    # all elements of one record, apart from the root
+    elements = len(minidom.parseString(document).getElementsByTagName('*')) - 1
+    return max(1, size // elements)
+
+
+def _status(field):
+    with open('/proc/self/status') as f:
+        return int(re.search(field + r':\s+(\d+)', f.read()).group(1))
+
+
+def _peak_rss():
+    """Return the current memory of the process in kilobytes and a function
+    returning its peak memory since. On Linux the peak is reset first, so that
+    memory freed before doesn't hide the peak of what follows.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _status('VmRSS'), lambda: _status('VmHWM')
+    except (IOError, AttributeError):
+        # ru_maxrss is in kilobytes on Linux, bytes on OS X
+        maxrss = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss(), maxrss
+
+
+def _measure_memory(run, data):
+    gc.collect()
+    objects = len(gc.get_objects())
+    rss, peak = _peak_rss()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    result = run(data)
+    traced = None
+    if tracemalloc is not None:
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    peak_rss = peak() - rss
+    gc.collect()
+    output = None
+    if isinstance(result, OfflineConnection):
+        output = {'size': len(result.body), 'sha1': hashlib.sha1(result.body).hexdigest()}
+    return {'peak_rss_kb': peak_rss, 'retained_objects': len(gc.get_objects()) - objects,
+            'peak_traced_bytes': traced, 'output': output}
+
+
+def measure(name, size, min_time, max_runs):
+    """Run a case and return its results."""
+    setup, run, document = CASES[name]
+    records = records_for(name, size)
+    data = setup(records)
+    results = {'case': name, 'size': size, 'records': records}
+    results.update(_measure_memory(run, data))
+
+    times = []
+    started = time.time()
+    while len(times) < max_runs and (not times or time.time() - started < min_time):
+        gc.collect()
+        run_started = time.time()
+        run(data)
+        times.append(time.time() - run_started)
+    times.sort()
+    results.update({'runs': len(times),
+                    'seconds_min': times[0],
+                    'seconds_median': times[len(times) // 2],
+                    'microseconds_per_element': times[0] / size * 1e6})
+    return results
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, out=sys.stdout):
+    """Print the change of the times and memory of the cases in both results."""
+    previous = dict(((r['case'], r['size']), r) for r in old['results'])
+    out.write('%-16s %7s %12s %12s %8s %10s\n' % ('case', 'size', 'before (s)', 'after (s)', 'change', 'memory'))
+    for result in new['results']:
+        before = previous.get((result['case'], result['size']))
+        if before is None:
+            continue
+        change = result['seconds_min'] / before['seconds_min'] - 1 if before['seconds_min'] else 0
+        memory = result['peak_rss_kb'] - before['peak_rss_kb']
+        flag = ''
+        if (before['output'] or {}).get('sha1') != (result['output'] or {}).get('sha1'):
+            flag = '  output differs'
+        out.write('%-16s %7d %12.6f %12.6f %+7.1f%% %+8d KB%s\n' % (
+            result['case'], result['size'], before['seconds_min'], result['seconds_min'], change * 100, memory, flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the youtrack library.')
+    parser.add_argument('--sizes', default='1,1000,100000', help='comma-separated numbers of elements')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help='comma-separated cases to run')
+    parser.add_argument('--min-time', type=float, default=1, help='seconds to repeat every case for')
+    parser.add_argument('--max-runs', type=int, default=100, help='maximum runs of every case')
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    parser.add_argument('--compare', metavar='RESULTS', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--child', nargs=2, metavar=('CASE', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        json.dump(measure(args.child[0], int(args.child[1]), args.min_time, args.max_runs), sys.stdout)
+        return
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for name in args.cases.split(','):
+            # a process of its own, so that the memory of one case doesn't
+            # count for the next
+            output = subprocess.check_output([sys.executable, '-m', 'benchmarks.micro', '--child', name, str(size),
+                                              '--min-time', str(args.min_time), '--max-runs', str(args.max_runs)],
+                                             cwd=ROOT)
+            result = json.loads(output)
+            results.append(result)
+            sys.stderr.write('%-16s %7d %7d records %10.6f s %8.2f us/element %8d KB\n' % (
+                name, size, result['records'], result['seconds_min'], result['microseconds_per_element'],
+                result['peak_rss_kb']))
+
+    report = {'revision': git_revision(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
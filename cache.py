@@ -0,0 +1,59 @@
+"""
+Small in-process caches used by the hook.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """A thread-safe mapping whose entries expire after `ttl` seconds.
+
+    At most `maxsize` entries are kept; when the cache is full the least
+    recently used entry is evicted. `None` is a valid value, so negative
+    results can be cached as well.
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            # re-insert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.maxsize > 0:
+                self._entries.popitem(last=False)
+            self._entries[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
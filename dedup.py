@@ -0,0 +1,100 @@
+"""
+Persistent index of the commit/issue pairs a comment has been posted for.
+
+GitLab redelivers webhooks and the same commit is pushed to several branches,
+so the index is consulted before anything is sent to YouTrack. Entries expire
+after `ttl` seconds and at most `max_entries` are kept, oldest first out.
+
+A pair is claimed before its comment is posted, so that of two deliveries of
+a push processed at the same time only one posts it.
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class PostedIndex(object):
+    # expired and surplus entries are purged every so many additions
+    PURGE_INTERVAL = 1000
+    # claims neither confirmed nor released for this many seconds are taken
+    # to be left behind by a process that died
+    CLAIM_TIMEOUT = 300
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS posted ('
+                         'commit_id TEXT NOT NULL, issue_id TEXT NOT NULL, posted REAL NOT NULL, '
+                         'PRIMARY KEY (commit_id, issue_id))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS posted_time ON posted (posted)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS claims ('
+                         'commit_id TEXT NOT NULL, issue_id TEXT NOT NULL, claimed REAL NOT NULL, '
+                         'PRIMARY KEY (commit_id, issue_id))')
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._additions = 0
+        self.purge()
+
+    def contains(self, commit_id, issue_id):
+        with self._lock:
+            row = self._db.execute('SELECT 1 FROM posted WHERE commit_id = ? AND issue_id = ? AND posted > ?',
+                                   (commit_id, issue_id, time.time() - self.ttl)).fetchone()
+        return row is not None
+
+    def claim(self, commit_id, issue_id):
+        """Reserve a pair before posting its comment. Returns `False` if a
+        comment has been posted for it or another caller holds a claim on it;
+        otherwise the caller must `add` the pair once the comment is posted,
+        or `release` it if posting failed.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                # the first write locks the database, so that the check and
+                # the claim are atomic for other processes as well
+                self._db.execute('DELETE FROM claims WHERE commit_id = ? AND issue_id = ? AND claimed <= ?',
+                                 (commit_id, issue_id, now - self.CLAIM_TIMEOUT))
+                posted = self._db.execute('SELECT 1 FROM posted WHERE commit_id = ? AND issue_id = ? AND posted > ?',
+                                          (commit_id, issue_id, now - self.ttl)).fetchone()
+                claimed = posted is None and self._db.execute(
+                    'INSERT OR IGNORE INTO claims (commit_id, issue_id, claimed) VALUES (?, ?, ?)',
+                    (commit_id, issue_id, now)).rowcount == 1
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+        return claimed
+
+    def release(self, commit_id, issue_id):
+        """Give up the claim on a pair whose comment was not posted."""
+        with self._lock:
+            self._db.execute('DELETE FROM claims WHERE commit_id = ? AND issue_id = ?', (commit_id, issue_id))
+            self._db.commit()
+
+    def add(self, commit_id, issue_id):
+        """Record that a comment was posted for a pair, confirming its claim."""
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO posted (commit_id, issue_id, posted) VALUES (?, ?, ?)',
+                             (commit_id, issue_id, time.time()))
+            self._db.execute('DELETE FROM claims WHERE commit_id = ? AND issue_id = ?', (commit_id, issue_id))
+            self._db.commit()
+            self._additions += 1
+            purge = self._additions % self.PURGE_INTERVAL == 0
+        if purge:
+            self.purge()
+
+    def purge(self):
+        """Drop expired entries and the oldest ones beyond `max_entries`."""
+        with self._lock:
+            self._db.execute('DELETE FROM posted WHERE posted <= ?', (time.time() - self.ttl,))
+            self._db.execute('DELETE FROM claims WHERE claimed <= ?', (time.time() - self.CLAIM_TIMEOUT,))
+            surplus = self._db.execute('SELECT COUNT(*) FROM posted').fetchone()[0] - self.max_entries
+            if surplus > 0:
+                self._db.execute('DELETE FROM posted WHERE rowid IN '
+                                 '(SELECT rowid FROM posted ORDER BY posted LIMIT ?)', (surplus,))
+            self._db.commit()
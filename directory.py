@@ -0,0 +1,175 @@
+"""
+Local index of the YouTrack users, so that commit authors are mapped to
+logins without asking YouTrack.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+def normalize_email(email, domain_aliases=None):
+    """Return the form of an email address used as key of the index: lower
+    case, without a "+tag" suffix of the local part, and with the domain
+    replaced by its entry in `domain_aliases`, if any.
+    """
+    email = email.strip().lower()
+    local, at, domain = email.rpartition('@')
+    if not at:
+        return email
+    local = local.split('+', 1)[0]
+    if domain_aliases:
+        domain = domain_aliases.get(domain, domain)
+    return local + '@' + domain
+
+
+class UserDirectory(object):
+    """Maps email addresses to YouTrack logins from an in-memory index.
+
+    The index is built from the list of users of the connection returned by
+    `connection_factory` and refreshed every `refresh_interval` seconds by a
+    background thread. A refresh fetches the details (email address and full
+    name) only of users that are new or whose details are older than
+    `max_age` seconds, using `threads` parallel requests, and drops users that
+    no longer exist. If `path` is given, the index is saved there after every
+    refresh and loaded from there on creation, so that a restarted process
+    can map addresses right away.
+    """
+
+    VERSION = 1
+
+    def __init__(self, connection_factory, path=None, refresh_interval=900, max_age=24 * 3600, threads=8,
+                 domain_aliases=None, logger=None):
+        self.connection_factory = connection_factory
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.threads = threads
+        self.domain_aliases = dict((k.lower(), v.lower()) for k, v in (domain_aliases or {}).items())
+        self.logger = logger or logging.getLogger(__name__)
+        # login -> (email, full name, time the details were fetched)
+        self._users = {}
+        # normalized email -> login
+        self._logins = {}
+        self._ready = False
+        self._thread = None
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    @property
+    def ready(self):
+        """Whether the index has been built (or loaded) at least once."""
+        return self._ready
+
+    def lookup(self, email):
+        """Return the login of the user with the given email address, or
+        `None` if there is no such user.
+        """
+        return self._logins.get(normalize_email(email, self.domain_aliases))
+
+    def __len__(self):
+        return len(self._users)
+
+    def start(self):
+        """Start the thread refreshing the index, unless it is running."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='githook-user-directory')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                self.logger.exception("Couldn't refresh the user directory")
+            time.sleep(self.refresh_interval)
+
+    def refresh(self):
+        """Bring the index up to date with YouTrack."""
+        yt = self.connection_factory()
+        now = time.time()
+        users = {}
+        stale = []
+        for user in yt.iterUsers(compact=True):
+            login = user.login
+            known = self._users.get(login)
+            if getattr(user, 'email', None) is not None:
+                # the list already has the details
+                users[login] = (user.email, getattr(user, 'fullName', None), now)
+            elif known is None or known[2] + self.max_age <= now:
+                stale.append(login)
+            else:
+                users[login] = known
+
+        pool = ThreadPool(max(1, min(self.threads, len(stale))))
+        try:
+            for login, details in pool.imap_unordered(lambda login: (login, self._fetch(yt, login)), stale):
+                if details is not None:
+                    users[login] = details + (now,)
+                elif login in self._users:
+                    # keep what we know, try again next time
+                    users[login] = self._users[login]
+        finally:
+            pool.close()
+
+        self._install(users)
+        self.logger.info('User directory refreshed: %d users, %d fetched', len(users), len(stale))
+        if self.path:
+            self.save()
+
+    def _fetch(self, yt, login):
+        try:
+            user = yt.getUser(login)
+        except Exception:
+            self.logger.warn("Couldn't fetch the details of user %s", login)
+            return None
+        return getattr(user, 'email', None), getattr(user, 'fullName', None)
+
+    def _install(self, users):
+        logins = {}
+        for login in sorted(users):
+            email = users[login][0]
+            if not email:
+                continue
+            key = normalize_email(email, self.domain_aliases)
+            if key in logins:
+                self.logger.debug('Users %s and %s share the email address %s', logins[key], login, email)
+                continue
+            logins[key] = login
+        # replaced, not updated, so that lookups don't need the lock
+        self._users = users
+        self._logins = logins
+        self._ready = True
+
+    def load(self):
+        """Load the index saved at `path`, if there is one."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except IOError:
+            return
+        except ValueError:
+            self.logger.warn('Ignoring the corrupt user directory %s', self.path)
+            return
+        if data.get('version') != self.VERSION:
+            return
+        self._install(dict((login, tuple(details)) for login, details in data['users'].items()))
+
+    def save(self):
+        """Save the index to `path`, replacing the file atomically."""
+        data = {'version': self.VERSION, 'users': self._users}
+        fd, tmp = tempfile.mkstemp(prefix='.users', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp, self.path)
+        except Exception:
+            os.unlink(tmp)
+            raise
@@ -1,8 +1,22 @@
 import re
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import dateutil.parser
 from flask import Flask, request, Response
 from youtrack.connection import Connection
 from youtrack import YouTrackException
+from youtrack.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, is_outage
+from youtrack.ratelimit import RateLimiter
+from cache import TTLCache
+from jobs import WorkerPool, QueueFull
+from spool import Spool
+from dedup import PostedIndex
+from references import IssueReferenceExtractor
+from directory import UserDirectory
+from mirror import missing_commits
+from metrics import Registry, Counter, Gauge, Histogram, path_template
 
 # Configuration
 YOUTRACK_URL = ''
@@ -10,63 +24,634 @@ YOUTRACK_USERNAME = ''
 YOUTRACK_PASSWORD = ''
 YOUTRACK_APIKEY = ''
 REGEX = '([A-Z]+-\d+)'
+PROJECT_FILTER = False
+PROJECT_REFRESH_INTERVAL = 3600
 DEFAULT_USER = ''
+USER_CACHE_TTL = 3600
+USER_CACHE_NEGATIVE_TTL = 600
+USER_CACHE_SIZE = 1000
+MISSING_ISSUE_CACHE_TTL = 300
+MISSING_ISSUE_CACHE_SIZE = 10000
+AUTHOR_LOOKUP_THREADS = 4
+USER_DIRECTORY = False
+USER_DIRECTORY_PATH = ''
+USER_DIRECTORY_REFRESH_INTERVAL = 900
+USER_DIRECTORY_MAX_AGE = 24 * 3600
+USER_DIRECTORY_THREADS = 8
+USER_DOMAIN_ALIASES = {}
+ASYNC_PROCESSING = False
+WORKER_THREADS = 4
+QUEUE_SIZE = 100
+RETRY_AFTER = 30
+WORKER_LANES = [('default-branch', r'refs/heads/(master|main)$', 3), ('other-branches', r'', 3)]
+MAX_IMMEDIATE_REFERENCES = 100
+DEFERRED_WORKER_THREADS = 1
+DEFERRED_QUEUE_SIZE = 1000
+GIT_MIRRORS = {}
+GIT_MIRROR_FETCH = False
+SPOOL_PATH = ''
+SPOOL_COMMIT_DELAY = 0.005
+SPOOL_RETRY_BACKOFF = 30
+SPOOL_RETRY_MAX_BACKOFF = 1800
+DEDUP_PATH = ''
+DEDUP_TTL = 30 * 24 * 3600
+DEDUP_MAX_ENTRIES = 100000
+COMMENT_THREADS = 8
+AGGREGATE_COMMENTS = False
+MAX_COMMENT_SIZE = 30000
+BACKFILL_BATCH_SIZE = 100
+YOUTRACK_MAX_CONNECTIONS = 16
+YOUTRACK_IDLE_TIMEOUT = 60
+YOUTRACK_CONNECT_TIMEOUT = 10
+YOUTRACK_READ_TIMEOUT = 60
+YOUTRACK_PAGE_WINDOW = 4
+YOUTRACK_BREAKER = True
+YOUTRACK_BREAKER_FAILURE_RATE = 0.5
+YOUTRACK_BREAKER_SLOW_CALL_DURATION = 10
+YOUTRACK_BREAKER_SLOW_CALL_RATE = 0.5
+YOUTRACK_BREAKER_MINIMUM_CALLS = 10
+YOUTRACK_BREAKER_WINDOW = 60
+YOUTRACK_BREAKER_OPEN_DURATION = 30
+YOUTRACK_RETRIES = 3
+YOUTRACK_RETRY_BACKOFF = 0.5
+YOUTRACK_RETRY_MAX_BACKOFF = 10
+YOUTRACK_READ_RATE = 0
+YOUTRACK_READ_BURST = 100
+YOUTRACK_COMMAND_RATE = 0
+YOUTRACK_COMMAND_BURST = 40
+YOUTRACK_RATE_LIMIT_PATH = ''
 
 app = Flask(__name__)
 app.config.from_object(__name__)
 app.config.from_pyfile('settings.cfg', silent=True)
 app.config.from_envvar('GITHOOK_SETTINGS', silent=True)
 
+_connection = None
+_connection_lock = threading.Lock()
+
+# number of threads -> ThreadPool of parallel_map
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+issue_extractor = IssueReferenceExtractor(
+    app.config['REGEX'], (lambda: get_connection().getProjects().keys()) if app.config['PROJECT_FILTER'] else None,
+    app.config['PROJECT_REFRESH_INTERVAL'], app.logger)
+
+# email address -> YouTrack login, `None` for authors without a YouTrack account
+user_cache = TTLCache(app.config['USER_CACHE_TTL'], app.config['USER_CACHE_SIZE'])
+_NOT_CACHED = object()
+
+# stops sending requests to YouTrack while it is failing
+breaker = CircuitBreaker(app.config['YOUTRACK_BREAKER_FAILURE_RATE'], app.config['YOUTRACK_BREAKER_SLOW_CALL_DURATION'],
+                         app.config['YOUTRACK_BREAKER_SLOW_CALL_RATE'], app.config['YOUTRACK_BREAKER_MINIMUM_CALLS'],
+                         app.config['YOUTRACK_BREAKER_WINDOW'],
+                         app.config['YOUTRACK_BREAKER_OPEN_DURATION']) if app.config['YOUTRACK_BREAKER'] else None
+
+# budgets of requests to YouTrack
+rate_limiter = RateLimiter({'read': (app.config['YOUTRACK_READ_RATE'], app.config['YOUTRACK_READ_BURST']),
+                            'command': (app.config['YOUTRACK_COMMAND_RATE'], app.config['YOUTRACK_COMMAND_BURST'])},
+                           app.config['YOUTRACK_RATE_LIMIT_PATH'] or None)
+
+# local index of the YouTrack users, consulted instead of YouTrack once built
+user_directory = UserDirectory(lambda: get_connection(), app.config['USER_DIRECTORY_PATH'] or None,
+                               app.config['USER_DIRECTORY_REFRESH_INTERVAL'], app.config['USER_DIRECTORY_MAX_AGE'],
+                               app.config['USER_DIRECTORY_THREADS'], app.config['USER_DOMAIN_ALIASES'],
+                               app.logger) if app.config['USER_DIRECTORY'] else None
+
+# ids of referenced issues that don't exist in YouTrack
+missing_issues = TTLCache(app.config['MISSING_ISSUE_CACHE_TTL'], app.config['MISSING_ISSUE_CACHE_SIZE'])
+
+# the lanes push events are queued in, by priority, with the pattern their
+# ref must match; the deferred parts of oversized pushes come last
+DEFERRED_LANE = 'deferred'
+lane_patterns = [(name, re.compile(pattern)) for name, pattern, limit in app.config['WORKER_LANES']]
+
+# processes the push events, fairly across the repositories of a lane
+worker_pool = WorkerPool(lambda job: process_job(*job), app.config['WORKER_THREADS'], app.config['QUEUE_SIZE'],
+                         app.logger, [(name, limit) for name, pattern, limit in app.config['WORKER_LANES']] +
+                         [(DEFERRED_LANE, app.config['DEFERRED_WORKER_THREADS'], app.config['DEFERRED_QUEUE_SIZE'])])
+
+# accepted push events are stored here until they are processed completely
+spool = Spool(app.config['SPOOL_PATH'], app.config['SPOOL_COMMIT_DELAY']) if app.config['SPOOL_PATH'] else None
+
+# (commit id, issue id) pairs a comment has already been posted for
+posted_index = PostedIndex(app.config['DEDUP_PATH'], app.config['DEDUP_TTL'],
+                           app.config['DEDUP_MAX_ENTRIES']) if app.config['DEDUP_PATH'] else None
+
+# exported at /metrics
+metrics = Registry()
+webhook_duration = metrics.register(Histogram(
+    'githook_webhook_duration_seconds', 'Time taken to answer a webhook request', ['status']))
+push_event_duration = metrics.register(Histogram(
+    'githook_push_event_duration_seconds', 'Time from receiving a push event until it is processed completely'))
+youtrack_request_duration = metrics.register(Histogram(
+    'githook_youtrack_request_duration_seconds', 'Time taken by requests to YouTrack', ['method', 'path']))
+youtrack_response_size = metrics.register(Histogram(
+    'githook_youtrack_response_size_bytes', 'Size of the responses of YouTrack', ['method', 'path'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000)))
+youtrack_errors = metrics.register(Counter(
+    'githook_youtrack_errors_total', 'Failed requests to YouTrack, by status code ("none" if there was no response)',
+    ['status']))
+commits_processed = metrics.register(Counter('githook_commits_processed_total', 'Commits of processed push events'))
+issues_referenced = metrics.register(Counter('githook_issues_referenced_total', 'Issue references found in commits'))
+comments_posted = metrics.register(Counter('githook_comments_posted_total', 'Comments posted on issues'))
+metrics.register(Counter(
+    'githook_cache_hits_total', 'Cache lookups that found an entry', ['cache'],
+    lambda: {('user',): user_cache.hits, ('missing_issue',): missing_issues.hits}))
+metrics.register(Counter(
+    'githook_cache_misses_total', 'Cache lookups that found no entry', ['cache'],
+    lambda: {('user',): user_cache.misses, ('missing_issue',): missing_issues.misses}))
+metrics.register(Gauge('githook_queue_depth', 'Push events waiting for a worker', ['lane'],
+                       lambda: dict(((lane,), worker_pool.qsize(lane)) for lane in worker_pool.lanes)))
+metrics.register(Gauge('githook_queue_running', 'Push events being processed', ['lane'],
+                       lambda: dict(((lane,), worker_pool.running(lane)) for lane in worker_pool.lanes)))
+queue_wait = metrics.register(Histogram(
+    'githook_queue_wait_seconds', 'Time push events waited for a worker', ['lane'],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900, 3600)))
+worker_pool.listeners.append(lambda lane, seconds: queue_wait.observe(seconds, lane=lane))
+metrics.register(Gauge('githook_youtrack_requests_in_flight', 'Requests to YouTrack being sent',
+                       function=lambda: _connection.pool.in_use() if _connection is not None else 0))
+rate_limit_wait = metrics.register(Histogram(
+    'githook_youtrack_rate_limit_wait_seconds', 'Time requests to YouTrack waited for the rate limiter', ['class'],
+    buckets=(0, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)))
+rate_limiter.listeners.append(lambda name, seconds: rate_limit_wait.observe(seconds, **{'class': name}))
+missing_issue_references = metrics.register(Counter(
+    'githook_missing_issue_references_total', "References to issues that don't exist in YouTrack"))
+metrics.register(Gauge(
+    'githook_youtrack_circuit_open', 'Whether requests to YouTrack are refused as it is considered unavailable',
+    function=lambda: int(breaker is not None and breaker.state == CircuitBreaker.OPEN)))
+metrics.register(Counter(
+    'githook_youtrack_requests_rejected_total', 'Requests to YouTrack refused by the circuit breaker',
+    function=lambda: breaker.rejected if breaker is not None else 0))
+
+
+def record_youtrack_request(method, url, status, seconds, size):
+    path = path_template(url)
+    youtrack_request_duration.observe(seconds, method=method, path=path)
+    if size is not None:
+        youtrack_response_size.observe(size, method=method, path=path)
+    if status is None or status >= 400:
+        youtrack_errors.inc(status=str(status) if status is not None else 'none')
+
 
 # Application
 @app.route('/')
 def ping():
     return 'ping'
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/hook', methods=['POST'])
 @app.route('/push_event', methods=['POST'])
 def push_event_hook():
-    push_event = request.json
+    started = time.time()
+    status = 500
+    try:
+        response = receive_push_event(request.json, started)
+        status = response.status_code
+        return response
+    finally:
+        webhook_duration.observe(time.time() - started, status=str(status))
+
+
+def receive_push_event(push_event, received):
+    """Check, spool and process (or queue) a push event received at the time
+    `received`, and return the response to the webhook request.
+    """
     app.logger.debug(push_event)
+    if not is_push_event(push_event):
+        return Response('Not a push event.', status=400, mimetype='text/plain')
+
+    push_event, deferred = split_push_event(push_event)
+    event_id = spool.append(push_event) if spool is not None else None
+    try:
+        if not app.config['ASYNC_PROCESSING']:
+            # processed by the request's thread, not the worker pool, so that
+            # deferred work doesn't hold up the response; failures are
+            # answered with an error, for GitLab to redeliver the event
+            process_job(event_id, push_event, received, None)
+        else:
+            worker_pool.submit((event_id, push_event, received), lane=select_lane(push_event),
+                               key=push_event['repository']['url'])
+    except QueueFull:
+        if event_id is not None:
+            # GitLab redelivers the event, so it does not need to be kept
+            spool.complete(event_id)
+        app.logger.warn('Queue is full, rejecting push event for %s', push_event['repository']['url'])
+        return Response('Too many push events queued, try again later.', status=503, mimetype='text/plain',
+                        headers={'Retry-After': str(app.config['RETRY_AFTER'])})
+    except (CircuitOpenError, YouTrackException), e:
+        if event_id is not None:
+            # GitLab redelivers the event; kept in the spool it would be
+            # replayed as well, posting its comments twice
+            spool.complete(event_id)
+        if isinstance(e, YouTrackException) and not is_outage(e.response.status):
+            raise
+        app.logger.error("Couldn't process push event for %s: %s", push_event['repository']['url'], e)
+        retry_after = int(e.retry_after) + 1 if isinstance(e, CircuitOpenError) else app.config['RETRY_AFTER']
+        return Response('YouTrack is unavailable, try again later.', status=503, mimetype='text/plain',
+                        headers={'Retry-After': str(retry_after)})
+    # only now, as a push that is rejected is delivered again, deferred part included
+    if deferred is not None:
+        defer_push_event(deferred)
+    if not app.config['ASYNC_PROCESSING']:
+        return Response('Push event processed. Thanks!', mimetype='text/plain')
+    return Response('Push event queued. Thanks!', status=202, mimetype='text/plain')
+
+
+def select_lane(push_event):
+    """Return the lane a push event is queued in: the first of WORKER_LANES
+    whose pattern matches its ref, else the last of them.
+    """
+    if push_event.get('githook_deferred'):
+        return DEFERRED_LANE
+    for name, pattern in lane_patterns:
+        if pattern.match(push_event['ref']):
+            return name
+    return lane_patterns[-1][0]
+
+
+def is_push_event(push_event):
+    """Check that a payload has the fields needed to process it."""
+    try:
+        return (isinstance(push_event['commits'], list) and 'ref' in push_event and 'user_name' in push_event and
+                all(key in push_event['repository'] for key in ('name', 'url', 'homepage')))
+    except (KeyError, TypeError):
+        return False
+
+
+@app.before_first_request
+def replay_spool():
+    """Resume the push events a previous run of the process left in the
+    spool.
+    """
+    if spool is None:
+        return
+    pending = spool.pending()
+    if pending:
+        app.logger.info('Replaying %d push events from the spool', len(pending))
+        thread = threading.Thread(target=_replay, args=(pending,), name='githook-replay')
+        thread.daemon = True
+        thread.start()
+
+
+@app.before_first_request
+def start_user_directory():
+    """Start building and refreshing the user directory in the background."""
+    if user_directory is not None:
+        user_directory.start()
+
+
+def _replay(pending):
+    for event_id, push_event in pending:
+        if app.config['ASYNC_PROCESSING'] or push_event.get('githook_deferred'):
+            worker_pool.submit((event_id, push_event, None), block=True, lane=select_lane(push_event),
+                               key=push_event['repository']['url'])
+        else:
+            try:
+                process_job(event_id, push_event, None)
+            except Exception:
+                app.logger.exception('Failed to replay push event %d', event_id)
+
+
+def split_push_event(push_event):
+    """Split an oversized push into the part that is processed right away and
+    the part that is deferred to the low-priority lane, which is `None` if
+    nothing is deferred.
+
+    Commits are deferred once their references would exceed
+    MAX_IMMEDIATE_REFERENCES; the references are counted without checking
+    their projects, so that the webhook request doesn't wait for the project
+    names to be loaded. If GitLab left commits out of the payload and
+    GIT_MIRRORS has a mirror of the repository, they are read from the mirror
+    when the deferred part is processed.
+    """
+    if push_event.get('githook_deferred'):
+        return push_event, None
+    commits = push_event['commits']
+    limit = app.config['MAX_IMMEDIATE_REFERENCES']
+    cut = len(commits)
+    if limit:
+        references = 0
+        for i, commit in enumerate(commits):
+            references += len(issue_extractor.extract(commit['message'], check_projects=False))
+            if references > limit:
+                cut = i
+                break
+    try:
+        incomplete = int(push_event.get('total_commits_count') or 0) > len(commits)
+    except (TypeError, ValueError):
+        incomplete = False
+    mirror = incomplete and push_event['repository']['url'] in app.config['GIT_MIRRORS']
+    if cut == len(commits) and not mirror:
+        return push_event, None
+    app.logger.info('Deferring %d of %d commits%s of push to %s', len(commits) - cut, len(commits),
+                    ' and the commits missing from the payload' if mirror else '', push_event['repository']['url'])
+    if mirror:
+        # the commits read from the mirror are those not in the payload
+        if commits:
+            url_prefix = commits[0]['url'].rsplit('/', 1)[0] + '/'
+        else:
+            url_prefix = push_event['repository']['homepage'].rstrip('/') + '/commit/'
+        mirror = {'known': [commit['id'] for commit in commits], 'url_prefix': url_prefix}
+    return (dict(push_event, commits=commits[:cut]),
+            dict(push_event, commits=commits[cut:], githook_deferred=True, githook_mirror=mirror or None))
+
+
+def defer_push_event(push_event):
+    """Queue the deferred part of a push in the low-priority lane."""
+    event_id = spool.append(push_event) if spool is not None else None
+    try:
+        worker_pool.submit((event_id, push_event, None), lane=DEFERRED_LANE, key=push_event['repository']['url'])
+    except QueueFull:
+        app.logger.error('Deferred queue is full, %s part of push to %s', 'postponing' if event_id is not None
+                         else 'dropping', push_event['repository']['url'])
+
+
+def process_job(event_id, push_event, received, attempt=0):
+    """Process a push event taken from the queue.
+
+    A spooled event that fails because YouTrack is unavailable is queued
+    again after a backoff, unless `attempt` (the number of earlier failures)
+    is `None`, in which case the error is raised to the caller.
+    """
+    try:
+        if push_event.get('githook_deferred'):
+            handle_deferred_push_event(event_id, push_event)
+        else:
+            handle_push_event(event_id, push_event, received)
+    except (CircuitOpenError, YouTrackException), e:
+        if (attempt is None or event_id is None or
+                isinstance(e, YouTrackException) and not is_outage(e.response.status)):
+            raise
+        delay = min(app.config['SPOOL_RETRY_BACKOFF'] * 2 ** attempt, app.config['SPOOL_RETRY_MAX_BACKOFF'])
+        if isinstance(e, CircuitOpenError):
+            delay = max(delay, e.retry_after)
+        app.logger.warn('YouTrack is unavailable, retrying push event %d for %s in %d s: %s', event_id,
+                        push_event['repository']['url'], delay, e)
+        worker_pool.submit_later((event_id, push_event, received, attempt + 1), delay, lane=select_lane(push_event),
+                                 key=push_event['repository']['url'])
+
+
+def handle_deferred_push_event(event_id, push_event):
+    """Process the deferred part of a push, including the commits read from
+    the mirror of the repository.
+    """
+    mirror = push_event['githook_mirror']
+    if mirror:
+        try:
+            older = missing_commits(app.config['GIT_MIRRORS'][push_event['repository']['url']], push_event['before'],
+                                    push_event['after'], mirror['known'], mirror['url_prefix'],
+                                    app.config['GIT_MIRROR_FETCH'])
+        except Exception:
+            app.logger.exception("Couldn't read the missing commits of push to %s from the mirror",
+                                 push_event['repository']['url'])
+        else:
+            push_event = dict(push_event, commits=older + push_event['commits'])
+    handle_push_event(event_id, push_event)
+
+
+def handle_push_event(event_id, push_event, received=None):
+    """Process a push event and remove it from the spool once it is done.
+    `event_id` is `None` if the spool is disabled, `received` the time the
+    event was received, if known.
+    """
+    process_push_event(push_event, event_id)
+    if event_id is not None:
+        spool.complete(event_id)
+    if received is not None:
+        push_event_duration.observe(time.time() - received)
+
+
+def process_push_event(push_event, event_id=None):
+    """Post a comment for every issue referenced by a commit of the push.
+
+    If the push event is spooled, every handled reference is checkpointed and
+    references handled before are skipped. YouTrack server errors are raised,
+    so that the event stays in the spool to be retried.
+    """
     user_name = push_event['user_name']
-    repo_name = push_event['repository']['name']
     repo_url = push_event['repository']['url']
-    repo_homepage = push_event['repository']['homepage']
     refspec = push_event['ref']
     app.logger.debug('Received push event by %s in branch %s on repository %s', user_name, refspec, repo_url)
 
+    commits_processed.inc(len(push_event['commits']))
+    referencing_commits = []
     for commit in push_event['commits']:
         app.logger.debug('Processing commit %s by %s (%s) in %s', commit['id'], commit['author']['name'], commit['author']['email'], commit['url'])
-        commit_time = dateutil.parser.parse(commit['timestamp'])
-        issues = re.findall(app.config['REGEX'], commit['message'], re.MULTILINE)
+        issues = issue_extractor.extract(commit['message'])
         if not issues:
             app.logger.debug('''Didn't find any referenced issues in commit %s''', commit['id'])
+            continue
+        app.logger.debug('Found %d referenced issues in commit %s', len(issues), commit['id'])
+        issues_referenced.inc(len(issues))
+        if posted_index is not None:
+            issues = [issue_id for issue_id in issues if not posted_index.contains(commit['id'], issue_id)]
+            if not issues:
+                app.logger.debug('All issues referenced in commit %s have been commented on before', commit['id'])
+                continue
+        referencing_commits.append((commit, issues))
+    if not referencing_commits:
+        return
+
+    done = spool.checkpoints(event_id) if event_id is not None else set()
+    yt = get_connection()
+    user_logins = resolve_authors(yt, [commit['author']['email'] for commit, issues in referencing_commits])
+
+    # The commits referencing each issue, in push order. Issues are commented
+    # on in parallel, but the comments on one issue are posted in order.
+    references = OrderedDict()
+    for commit, issues in referencing_commits:
+        for issue_id in issues:
+            if (commit['id'], issue_id) in done:
+                app.logger.debug('Skipping reference to issue %s, it was handled before', issue_id)
+                continue
+            done.add((commit['id'], issue_id))
+            references.setdefault(issue_id, []).append(commit)
+
+    def comment_on_issue(issue_id):
+        for commits in group_commits(push_event, references[issue_id], user_logins):
+            post_comment(yt, push_event, commits, issue_id, user_logins[commits[0]['author']['email']], event_id)
+    parallel_map(comment_on_issue, references.keys(), app.config['COMMENT_THREADS'])
+
+
+def group_commits(push_event, commits, user_logins):
+    """Split the commits of a push referencing an issue into the groups that
+    are posted as one comment each. Unless AGGREGATE_COMMENTS is enabled every
+    commit gets a comment of its own; otherwise consecutive commits by the
+    same author are combined into comments of up to MAX_COMMENT_SIZE
+    characters.
+    """
+    if not app.config['AGGREGATE_COMMENTS']:
+        return [[commit] for commit in commits]
+    # no group has more commits, so no heading is longer
+    heading_size = len(format_heading(push_event, len(commits)))
+    groups = []
+    size = 0
+    for commit in commits:
+        commit_size = len(format_commit(commit)) + 1
+        if (groups and user_logins[commit['author']['email']] == user_logins[groups[-1][0]['author']['email']] and
+                size + commit_size <= app.config['MAX_COMMENT_SIZE']):
+            groups[-1].append(commit)
+            size += commit_size
         else:
-            app.logger.debug('Found %d referenced issues in commit %s', len(issues), commit['id'])
-            yt = Connection(app.config['YOUTRACK_URL'], app.config['YOUTRACK_USERNAME'], app.config['YOUTRACK_PASSWORD'])
-
-            user_login = get_user_login(yt, commit['author']['email'])
-            if user_login is None:
-                app.logger.warn("Couldn't find user with email address %s. Using default user.", commit['author']['email'])
-                default_user = yt.getUser(app.config['DEFAULT_USER'])
-                user_login = default_user['login']
-
-            for issue_id in issues:
-                app.logger.debug('Processing reference to issue %s', issue_id)
-                try:
-                    yt.getIssue(issue_id)
-                    comment_string = 'Commit [%(url)s %(id)s] on branch %(refspec)s in [%(repo_homepage)s %(repo_name)s] made by %(author)s on %(date)s\n{quote}%(message)s{quote}' % {'url': commit['url'], 'id': commit['id'], 'author': commit['author']['name'], 'date': str(commit_time), 'message': commit['message'], 'repo_homepage': repo_homepage, 'repo_name': repo_name, 'refspec': refspec}
-                    app.logger.debug(comment_string)
-                    yt.executeCommand(issueId=issue_id, command='comment', comment=comment_string.encode('utf-8'),
-                                      run_as=user_login.encode('utf-8'))
-                except YouTrackException:
-                    app.logger.warn("Couldn't find issue %s", issue_id)
-    return Response('Push event processed. Thanks!', mimetype='text/plain')
+            groups.append([commit])
+            size = heading_size + commit_size
+    return groups
+
+
+def format_comment(push_event, commits):
+    """Render the comment text about one or more commits."""
+    repository = push_event['repository']
+    if len(commits) == 1:
+        commit = commits[0]
+        return 'Commit [%(url)s %(id)s] on branch %(refspec)s in [%(repo_homepage)s %(repo_name)s] made by %(author)s on %(date)s\n{quote}%(message)s{quote}' % {'url': commit['url'], 'id': commit['id'], 'author': commit['author']['name'], 'date': str(dateutil.parser.parse(commit['timestamp'])), 'message': commit['message'], 'repo_homepage': repository['homepage'], 'repo_name': repository['name'], 'refspec': push_event['ref']}
+    return '\n'.join([format_heading(push_event, len(commits))] + [format_commit(commit) for commit in commits])
+
+
+def format_heading(push_event, count):
+    """Render the heading of a comment about `count` commits."""
+    repository = push_event['repository']
+    return '%d commits on branch %s in [%s %s]:' % (count, push_event['ref'], repository['homepage'], repository['name'])
+
+
+def format_commit(commit):
+    """Render the part of a combined comment about one commit."""
+    return 'Commit [%(url)s %(id)s] made by %(author)s on %(date)s\n{quote}%(message)s{quote}' % {'url': commit['url'], 'id': commit['id'], 'author': commit['author']['name'], 'date': str(dateutil.parser.parse(commit['timestamp'])), 'message': commit['message']}
+
+
+def post_comment(yt, push_event, commits, issue_id, user_login, event_id=None):
+    """Post one comment on an issue about the given commits referencing it.
+    The comment command is sent right away; issues it fails for with a 404 are
+    remembered as missing for MISSING_ISSUE_CACHE_TTL seconds.
+    """
+    app.logger.debug('Processing reference to issue %s', issue_id)
+    claimed = []
+    if missing_issues.get(issue_id):
+        app.logger.warn("Couldn't find issue %s", issue_id)
+    elif posted_index is None:
+        claimed = commits
+    else:
+        # another delivery of the push may be posting the same comment
+        claimed = [commit for commit in commits if posted_index.claim(commit['id'], issue_id)]
+        if not claimed:
+            app.logger.debug('Skipping reference to issue %s, it is commented on already', issue_id)
+    if claimed:
+        comment_string = format_comment(push_event, claimed)
+        app.logger.debug(comment_string)
+        try:
+            yt.executeCommand(issueId=issue_id, command='comment', comment=comment_string.encode('utf-8'),
+                              run_as=user_login.encode('utf-8'))
+            comments_posted.inc()
+            if posted_index is not None:
+                for commit in claimed:
+                    posted_index.add(commit['id'], issue_id)
+                claimed = []
+        except YouTrackException, e:
+            if is_outage(e.response.status):
+                # YouTrack is failing, not the reference; the event is retried
+                raise
+            if e.response.status == 404:
+                missing_issues.set(issue_id, True)
+                missing_issue_references.inc()
+                app.logger.warn("Couldn't find issue %s", issue_id)
+            else:
+                app.logger.warn("Couldn't comment on issue %s: %s", issue_id, e)
+        finally:
+            if posted_index is not None:
+                for commit in claimed:
+                    posted_index.release(commit['id'], issue_id)
+    if event_id is not None:
+        for commit in commits:
+            spool.checkpoint(event_id, commit['id'], issue_id)
+
+
+def parallel_map(func, items, threads):
+    """Like `map`, but calls `func` from up to `threads` threads at once. If
+    calls fail, the first exception is raised once all calls have returned.
+
+    The threads are those of a pool shared by all callers asking for the same
+    number of them, so `func` must not call `parallel_map` itself.
+    """
+    if min(len(items), threads) <= 1:
+        return [func(item) for item in items]
+    with _thread_pools_lock:
+        pool = _thread_pools.get(threads)
+        if pool is None:
+            pool = _thread_pools[threads] = ThreadPool(threads)
+    results = [pool.apply_async(func, (item,)) for item in items]
+    for result in results:
+        result.wait()
+    return [result.get() for result in results]
+
+
+def get_connection():
+    """Return the YouTrack connection shared by all requests of this process.
+    It is created on first use; an expired session is renewed by the
+    connection itself.
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            pool_options = {'pool_size': app.config['YOUTRACK_MAX_CONNECTIONS'],
+                            'idle_timeout': app.config['YOUTRACK_IDLE_TIMEOUT'],
+                            'connect_timeout': app.config['YOUTRACK_CONNECT_TIMEOUT'],
+                            'read_timeout': app.config['YOUTRACK_READ_TIMEOUT'],
+                            'page_window': app.config['YOUTRACK_PAGE_WINDOW'],
+                            'breaker': breaker,
+                            'limiter': rate_limiter,
+                            'retry': RetryPolicy(app.config['YOUTRACK_RETRIES'], app.config['YOUTRACK_RETRY_BACKOFF'],
+                                                 app.config['YOUTRACK_RETRY_MAX_BACKOFF'])}
+            if app.config['YOUTRACK_APIKEY']:
+                _connection = Connection(app.config['YOUTRACK_URL'], api_key=app.config['YOUTRACK_APIKEY'], **pool_options)
+            else:
+                _connection = Connection(app.config['YOUTRACK_URL'], app.config['YOUTRACK_USERNAME'], app.config['YOUTRACK_PASSWORD'],
+                                         **pool_options)
+            _connection.listeners.append(record_youtrack_request)
+        return _connection
+
+
+def resolve_authors(yt, emails):
+    """Map the given author email addresses to YouTrack logins. Each distinct
+    address is looked up only once, in parallel if AUTHOR_LOOKUP_THREADS allows
+    it. Authors without a YouTrack account are mapped to DEFAULT_USER.
+    """
+    emails = list(set(emails))
+    logins = parallel_map(lambda email: get_user_login(yt, email), emails, app.config['AUTHOR_LOOKUP_THREADS'])
+
+    user_logins = dict(zip(emails, logins))
+    default_login = None
+    for email in emails:
+        if user_logins[email] is None:
+            app.logger.warn("Couldn't find user with email address %s. Using default user.", email)
+            if default_login is None:
+                default_login = yt.getUser(app.config['DEFAULT_USER'])['login']
+            user_logins[email] = default_login
+    return user_logins
 
 
 def get_user_login(yt, email):
     """Given a youtrack connection and an email address, try to find the login
     name for a user. Returns `None` if no (unique) user was found.
+
+    Once the user directory is built, the address is looked up there only.
+    Otherwise results are cached for USER_CACHE_TTL seconds, unknown addresses
+    for USER_CACHE_NEGATIVE_TTL seconds.
+    """
+    if user_directory is not None and user_directory.ready:
+        return user_directory.lookup(email)
+    login = user_cache.get(email, _NOT_CACHED)
+    if login is _NOT_CACHED:
+        login = find_user_login(yt, email)
+        user_cache.set(email, login, None if login is not None else app.config['USER_CACHE_NEGATIVE_TTL'])
+    return login
+
+
+def find_user_login(yt, email):
+    """Look up the login name for an email address in YouTrack, bypassing the
+    cache.
     """
     users = yt.getUsers({'q': email})
     if len(users) == 1:
@@ -76,8 +661,9 @@ def get_user_login(yt, email):
         for user in users:
             try:
                 full_user = yt.getUser(user['login'])
-            except YouTrackException:
-                pass
+            except YouTrackException, e:
+                if is_outage(e.response.status):
+                    raise
             else:
                 if full_user['email'] == email:
                     return full_user['login']
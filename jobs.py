@@ -0,0 +1,214 @@
+"""
+Background processing of webhook payloads.
+"""
+
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Lane(object):
+    def __init__(self, name, limit, maxsize):
+        self.name = name
+        self.limit = limit
+        self.maxsize = maxsize
+        self.running = 0
+        self.size = 0
+        # key -> deque of (time queued, job, waiter), in round-robin order
+        self.keys = OrderedDict()
+
+    def add(self, key, entry):
+        self.keys.setdefault(key, deque()).append(entry)
+        self.size += 1
+
+    def pop(self):
+        key, entries = self.keys.popitem(last=False)
+        entry = entries.popleft()
+        if entries:
+            # the key goes to the back, after the others waiting
+            self.keys[key] = entries
+        self.size -= 1
+        return entry
+
+
+class FairQueue(object):
+    """Jobs waiting for a worker, in lanes of decreasing priority.
+
+    `lanes` is a list of `(name, limit)` or `(name, limit, maxsize)` tuples: a
+    job is taken from a lane only if all lanes before it are empty or running
+    their limit of jobs, and at most `limit` jobs of a lane run at once.
+    Within a lane jobs are taken round-robin by key, so that one key with many
+    jobs doesn't delay the others. At most `maxsize` jobs wait in a lane (0 for
+    no limit), the `maxsize` argument applies to lanes that don't give one.
+    """
+
+    def __init__(self, lanes, maxsize):
+        self.lanes = OrderedDict((lane[0], _Lane(lane[0], lane[1], lane[2] if len(lane) > 2 else maxsize))
+                                 for lane in lanes)
+        self._size = 0
+        self._unfinished = 0
+        self._condition = threading.Condition()
+
+    def put(self, job, lane, key, waiter=None, block=False):
+        lane = self.lanes[lane]
+        with self._condition:
+            while lane.maxsize and lane.size >= lane.maxsize:
+                if not block:
+                    raise QueueFull()
+                self._condition.wait()
+            lane.add(key, (time.time(), job, waiter))
+            self._size += 1
+            self._unfinished += 1
+            self._condition.notify_all()
+
+    def get(self):
+        """Take the next job; returns `(lane, seconds waited, job, waiter)`."""
+        with self._condition:
+            while True:
+                for lane in self.lanes.values():
+                    if lane.size and lane.running < lane.limit:
+                        queued, job, waiter = lane.pop()
+                        lane.running += 1
+                        self._size -= 1
+                        self._condition.notify_all()
+                        return lane.name, time.time() - queued, job, waiter
+                self._condition.wait()
+
+    def task_done(self, lane):
+        with self._condition:
+            self.lanes[lane].running -= 1
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def join(self):
+        with self._condition:
+            while self._unfinished:
+                self._condition.wait()
+
+    def qsize(self, lane=None):
+        if lane is None:
+            return self._size
+        return self.lanes[lane].size
+
+    def running(self, lane):
+        return self.lanes[lane].running
+
+
+class _Waiter(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.exc_info = None
+
+
+class WorkerPool(object):
+    """Hands jobs from a bounded `FairQueue` to a fixed number of worker
+    threads.
+
+    `handler` is called with each submitted job. `lanes` are the lanes of the
+    queue (see `FairQueue`), by default a single lane named "default", and
+    `maxsize` is the number of jobs that may wait in a lane. The threads are
+    started on the first submission, so that importing the application does
+    not spawn them.
+    """
+
+    def __init__(self, handler, workers, maxsize, logger=None, lanes=None):
+        self.handler = handler
+        self.workers = workers
+        self.logger = logger or logging.getLogger(__name__)
+        self._queue = FairQueue(lanes or [('default', workers)], maxsize)
+        # callables notified of every job taken from the queue, with the
+        # arguments (lane, seconds the job waited)
+        self.listeners = []
+        self._threads = []
+        self._lock = threading.Lock()
+        # (due time, sequence, job, lane, key) of the jobs submitted with a delay
+        self._delayed = []
+        self._delayed_condition = threading.Condition()
+        self._scheduler = None
+        self._sequence = itertools.count()
+
+    @property
+    def lanes(self):
+        return self._queue.lanes.keys()
+
+    def submit(self, job, block=False, lane=None, key=None):
+        """Queue a job in a lane (by default the first), for the given key.
+        Unless `block` is set, raises `QueueFull` instead of waiting if the
+        lane has reached its maximum depth.
+        """
+        self._start()
+        self._queue.put(job, lane or self.lanes[0], key, block=block)
+
+    def submit_later(self, job, delay, lane=None, key=None):
+        """Queue a job like `submit` once `delay` seconds have passed. If the
+        lane is full then, the job waits for room.
+        """
+        with self._delayed_condition:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule, name='githook-scheduler')
+                self._scheduler.daemon = True
+                self._scheduler.start()
+            heapq.heappush(self._delayed, (time.time() + delay, next(self._sequence), job, lane, key))
+            self._delayed_condition.notify()
+
+    def run(self, job, lane=None, key=None):
+        """Queue a job like `submit` and wait until it has been processed.
+        Exceptions raised by the handler are raised again.
+        """
+        self._start()
+        waiter = _Waiter()
+        self._queue.put(job, lane or self.lanes[0], key, waiter)
+        waiter.done.wait()
+        if waiter.exc_info is not None:
+            raise waiter.exc_info[0], waiter.exc_info[1], waiter.exc_info[2]
+
+    def qsize(self, lane=None):
+        return self._queue.qsize(lane)
+
+    def running(self, lane):
+        return self._queue.running(lane)
+
+    def join(self):
+        """Block until all queued jobs have been processed."""
+        self._queue.join()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name='githook-worker-%d' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _schedule(self):
+        while True:
+            with self._delayed_condition:
+                while not self._delayed or self._delayed[0][0] > time.time():
+                    self._delayed_condition.wait(self._delayed[0][0] - time.time() if self._delayed else None)
+                due, sequence, job, lane, key = heapq.heappop(self._delayed)
+            self.submit(job, True, lane, key)
+
+    def _run(self):
+        while True:
+            lane, waited, job, waiter = self._queue.get()
+            try:
+                for listener in self.listeners:
+                    listener(lane, waited)
+                self.handler(job)
+            except Exception:
+                if waiter is not None:
+                    waiter.exc_info = sys.exc_info()
+                else:
+                    self.logger.exception('Failed to process job')
+            finally:
+                self._queue.task_done(lane)
+                if waiter is not None:
+                    waiter.done.set()
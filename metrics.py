@@ -0,0 +1,176 @@
+"""
+Metrics of the hook, exported in the Prometheus text format.
+"""
+
+import re
+import threading
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _escape(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('%s takes the labels %s' % (self.name, ', '.join(self.labels)))
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, values, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(self.labels, values, extra),
+                                        _format_value(value)))
+        return '\n'.join(lines)
+
+    def samples(self):
+        """Yield `(name suffix, label values, extra labels, value)` tuples."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up. If `function` is given, it is called on
+    export and returns the value (or a dict mapping label value tuples to
+    values, if the counter has labels) instead of counting with `inc`.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help, labels=(), function=None):
+        _Metric.__init__(self, name, help, labels)
+        self.function = function
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+            if not self.labels:
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key in sorted(values):
+            yield '', key, (), values[key]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, usually read from `function` on
+    export.
+    """
+    type = 'gauge'
+
+
+class Histogram(_Metric):
+    """Counts observed values in buckets with the given upper bounds."""
+    type = 'histogram'
+
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values -> [bucket counts..., sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = dict((key, list(counts)) for key, counts in self._values.items())
+        for key in sorted(values):
+            counts = values[key]
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                yield '_bucket', key, (('le', _format_value(float(bound))),), total
+            yield '_sum', key, (), counts[-1]
+            yield '_count', key, (), total
+
+
+class Registry(object):
+    """The metrics exported together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return ''.join(metric.render() + '\n' for metric in self.metrics)
+
+
+# the segments of a YouTrack REST path followed by a name or id, and what it
+# is replaced with in path templates
+_PARAMETERS = {'issue': '{id}', 'byproject': '{project}', 'user': '{login}', 'project': '{project}',
+               'group': '{group}', 'role': '{role}', 'import': '{project}', 'customfield': '{field}',
+               'field': '{field}', 'bundle': '{bundle}', 'userBundle': '{bundle}', 'version': '{version}',
+               'build': '{build}', 'subsystem': '{subsystem}', 'issueLinkType': '{type}'}
+# segments in such places that are part of the path
+_LITERALS = set(['login', 'all', 'byproject', 'intellisense', 'issues', 'links', 'users', 'issue', 'field',
+                 'bundle', 'userBundle', 'assignee', 'timetracking', 'current'])
+
+
+# other segments like these are names or ids as well
+_OPAQUE = re.compile(r'[0-9%@.]')
+
+
+def path_template(url):
+    """Replace the names and ids in a YouTrack REST path by placeholders, e.g.
+    /issue/PROJ-1/execute?command=comment becomes /issue/{id}/execute, so that
+    the number of distinct paths stays bounded. The paths of attachments all
+    become /_persistent/{file}.
+    """
+    segments = re.split('[?#]', url, 1)[0].split('/')
+    if len(segments) > 2 and segments[1] == '_persistent':
+        return '/_persistent/{file}'
+    for i in range(1, len(segments)):
+        parameter = _PARAMETERS.get(segments[i - 1])
+        if parameter is not None and segments[i] and segments[i] not in _LITERALS:
+            segments[i] = parameter
+        elif _OPAQUE.search(segments[i]):
+            segments[i] = '{id}'
+    return '/'.join(segments)
@@ -0,0 +1,52 @@
+"""
+Reading commits from a local git repository, e.g. the commits of a push
+that GitLab left out of the webhook payload.
+"""
+
+import subprocess
+
+# GitLab sends this as "before" for a newly created branch
+NULL_SHA = '0' * 40
+
+# the fields of a commit in the output of git log: id, author name, author
+# email, author date, message
+_FORMAT = '%H%x00%an%x00%ae%x00%aI%x00%B%x1e'
+
+
+def missing_commits(path, before, after, known, url_prefix, fetch=False):
+    """Return the commits of a push from `before` to `after` that are not
+    among the ids in `known` (the commits of its payload), oldest first, in
+    the format of the payload, read from the git repository at `path`. If
+    `fetch` is set, the repository is fetched from its remote first.
+
+    Their url is `url_prefix` followed by the id. Pushes creating a branch are
+    left alone, as there is no way to tell which of its commits were pushed.
+    """
+    if before == NULL_SHA:
+        return []
+    if fetch:
+        subprocess.check_call(['git', 'fetch', '--quiet'], cwd=path)
+    known = set(known)
+    return [commit for commit in read_commits(path, '%s..%s' % (before, after), url_prefix)
+            if commit['id'] not in known]
+
+
+def read_commits(path, revisions, url_prefix):
+    """Return the commits in the given revision range (anything git log
+    accepts) of the git repository at `path`, oldest first, in the format of
+    the webhook payload. Their url is `url_prefix` followed by the id.
+    """
+    output = subprocess.check_output(['git', 'log', '--reverse', '--format=' + _FORMAT, revisions], cwd=path)
+    commits = []
+    for record in output.split('\x1e'):
+        record = record.strip('\n')
+        if not record:
+            continue
+        sha, name, email, date, message = record.split('\x00', 4)
+        commits.append({'id': sha,
+                        'message': message.rstrip('\n').decode('utf-8', 'replace'),
+                        'timestamp': date,
+                        'url': url_prefix + sha,
+                        'author': {'name': name.decode('utf-8', 'replace'),
+                                   'email': email.decode('utf-8', 'replace')}})
+    return commits
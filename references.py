@@ -0,0 +1,65 @@
+"""
+Extraction of issue references from commit messages.
+"""
+
+import logging
+import re
+import threading
+import time
+
+
+class IssueReferenceExtractor(object):
+    """Finds the issue ids referenced in commit messages.
+
+    The pattern is compiled once. Every issue is returned only once per
+    message, in order of first appearance. If a `project_loader` is given (a
+    callable returning the short names of the existing projects), references
+    to other projects, such as "UTF-8", are dropped. The project names are
+    loaded again every `refresh_interval` seconds.
+    """
+
+    def __init__(self, pattern, project_loader=None, refresh_interval=3600, logger=None):
+        self.regex = re.compile(pattern, re.MULTILINE)
+        self.project_loader = project_loader
+        self.refresh_interval = refresh_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._projects = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def extract(self, message, check_projects=True):
+        """Return the issue ids referenced in a message. If `check_projects`
+        is false, references to any project are returned, without loading the
+        project names.
+        """
+        projects = self.projects() if check_projects else None
+        issues = []
+        seen = set()
+        for issue_id in self.regex.findall(message):
+            if issue_id in seen:
+                continue
+            seen.add(issue_id)
+            if projects is not None and issue_id.rsplit('-', 1)[0] not in projects:
+                self.logger.debug('Ignoring reference to %s, there is no such project', issue_id)
+                continue
+            issues.append(issue_id)
+        return issues
+
+    def projects(self):
+        """Return the set of known project short names, or `None` if they are
+        not known (no loader or loading failed so far).
+        """
+        if self.project_loader is None:
+            return None
+        if self._loaded + self.refresh_interval <= time.time() and self._lock.acquire(False):
+            # only one thread refreshes, the others keep using the old names
+            try:
+                self._projects = set(self.project_loader())
+                self._loaded = time.time()
+            except Exception:
+                self.logger.exception("Couldn't load the project names")
+                # try again in a minute
+                self._loaded = time.time() - self.refresh_interval + min(60, self.refresh_interval)
+            finally:
+                self._lock.release()
+        return self._projects
@@ -0,0 +1,109 @@
+"""
+Durable on-disk spool for accepted push events.
+
+Every push event is written to an SQLite database before the webhook is
+acknowledged, together with a checkpoint for every commit/issue pair that has
+been handled. Events that were not completed (because the process died or
+YouTrack was unavailable) can be replayed from the spool after a restart
+without posting the same comment twice.
+
+Writes are group-committed: concurrent callers queue their statements and a
+single flusher thread commits them together, so one fsync covers a whole batch.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class Spool(object):
+    def __init__(self, path, commit_delay=0.005):
+        self.path = path
+        self.commit_delay = commit_delay
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS events ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, received REAL NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS checkpoints ('
+                         'event_id INTEGER NOT NULL, commit_id TEXT NOT NULL, issue_id TEXT NOT NULL, '
+                         'PRIMARY KEY (event_id, commit_id, issue_id))')
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flushing = threading.Condition(threading.Lock())
+        self._flusher = threading.Thread(target=self._flush_loop, name='githook-spool')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def append(self, push_event):
+        """Store a push event durably and return its id."""
+        return self._write(('INSERT INTO events (payload, received) VALUES (?, ?)',
+                            (json.dumps(push_event), time.time())))
+
+    def checkpoint(self, event_id, commit_id, issue_id):
+        """Record that the reference from a commit to an issue was handled."""
+        self._write(('INSERT OR IGNORE INTO checkpoints (event_id, commit_id, issue_id) VALUES (?, ?, ?)',
+                     (event_id, commit_id, issue_id)))
+
+    def checkpoints(self, event_id):
+        """Return the set of (commit id, issue id) pairs handled for an event."""
+        with self._lock:
+            rows = self._db.execute('SELECT commit_id, issue_id FROM checkpoints WHERE event_id = ?',
+                                    (event_id,)).fetchall()
+        return set(rows)
+
+    def complete(self, event_id):
+        """Remove a fully processed (or discarded) event from the spool."""
+        # in one commit, so that an event is never left without its checkpoints
+        self._write(('DELETE FROM events WHERE id = ?', (event_id,)),
+                    ('DELETE FROM checkpoints WHERE event_id = ?', (event_id,)))
+
+    def pending(self):
+        """Return (id, push event) for every event not completed yet, oldest
+        first.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT id, payload FROM events ORDER BY id').fetchall()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+
+    def _write(self, *statements):
+        """Queue `(sql, params)` statements for the next group commit and wait
+        until they are durable. They are committed together. Returns the id of
+        the row inserted by the last one.
+        """
+        write = {'statements': statements, 'done': threading.Event()}
+        with self._flushing:
+            self._pending.append(write)
+            self._flushing.notify()
+        write['done'].wait()
+        if 'error' in write:
+            raise write['error']
+        return write['rowid']
+
+    def _flush_loop(self):
+        while True:
+            with self._flushing:
+                while not self._pending:
+                    self._flushing.wait()
+            # give concurrent writers a moment to join this batch
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+            with self._flushing:
+                batch, self._pending = self._pending, []
+            self._flush(batch)
+
+    def _flush(self, batch):
+        with self._lock:
+            try:
+                for write in batch:
+                    for sql, params in write['statements']:
+                        write['rowid'] = self._db.execute(sql, params).lastrowid
+                self._db.commit()
+            except sqlite3.Error, e:
+                self._db.rollback()
+                for write in batch:
+                    write['error'] = e
+        for write in batch:
+            write['done'].set()
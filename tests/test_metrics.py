@@ -0,0 +1,30 @@
+import unittest
+
+from metrics import path_template
+
+
+class PathTemplateTest(unittest.TestCase):
+    def test_names_after_known_segments(self):
+        self.assertEqual(path_template('/issue/PROJ-1/execute?command=comment'), '/issue/{id}/execute')
+        self.assertEqual(path_template('/admin/project/PROJ/version/1.0'), '/admin/project/{project}/version/{version}')
+        self.assertEqual(path_template('/issue/byproject/PROJ?after=0&max=10'), '/issue/byproject/{project}')
+        self.assertEqual(path_template('/user/login'), '/user/login')
+
+    def test_attachments(self):
+        self.assertEqual(path_template('/_persistent/screenshot.png?file=74-12&v=0&c=true'), '/_persistent/{file}')
+        self.assertEqual(path_template('/_persistent/a/b/report.pdf'), '/_persistent/{file}')
+
+    def test_opaque_segments(self):
+        self.assertEqual(path_template('/issue/PROJ-1/attachment/74-12'), '/issue/{id}/attachment/{id}')
+        self.assertEqual(path_template('/admin/user/user%40example.com/group/developers'),
+                         '/admin/user/{login}/group/{group}')
+        self.assertEqual(path_template('/admin/timetracking/12345/workitem'), '/admin/timetracking/{id}/workitem')
+
+    def test_bounded(self):
+        paths = set(path_template('/_persistent/file%d.txt?file=%d' % (n, n)) for n in range(100))
+        paths.update(path_template('/issue/PROJ-%d/attachment/%d-%d' % (n, n, n)) for n in range(100))
+        self.assertEqual(len(paths), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
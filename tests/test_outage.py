@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import githook
+from spool import Spool
+from youtrack import YouTrackUnavailable
+from youtrack.connection import Connection
+from youtrack.resilience import RetryPolicy, is_outage
+
+
+def closed_port():
+    """Return the URL of a local port nothing listens on."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:%d' % port
+
+
+class ConnectionOutageTest(unittest.TestCase):
+    def test_refused_connection_is_an_outage(self):
+        yt = Connection(closed_port(), api_key='key', retry=RetryPolicy(1, 0, 0))
+        with self.assertRaises(YouTrackUnavailable) as raised:
+            yt.getIssue('PROJ-1')
+        self.assertTrue(is_outage(raised.exception.response.status))
+        self.assertIsInstance(raised.exception.cause, socket.error)
+
+
+class _WorkerPool(object):
+    def __init__(self):
+        self.delayed = []
+
+    def submit_later(self, job, delay, lane=None, key=None):
+        self.delayed.append((job, delay))
+
+
+class PushEventOutageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.saved = dict((name, getattr(githook, name)) for name in ('spool', 'breaker', 'posted_index', '_connection',
+                                                                       'worker_pool'))
+        self.config = dict(githook.app.config)
+        githook.app.config.update(YOUTRACK_URL=closed_port(), YOUTRACK_APIKEY='key', YOUTRACK_RETRIES=0,
+                                  ASYNC_PROCESSING=False, MAX_IMMEDIATE_REFERENCES=0, SPOOL_RETRY_BACKOFF=1)
+        githook.spool = Spool(os.path.join(self.directory, 'spool.db'))
+        githook.breaker = githook.posted_index = githook._connection = None
+        githook.user_cache.clear()
+        with open(os.path.join(os.path.dirname(__file__), '..', 'fixtures', '01.json')) as f:
+            self.push_event = json.load(f)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(githook, name, value)
+        githook.app.config.clear()
+        githook.app.config.update(self.config)
+        shutil.rmtree(self.directory)
+
+    def test_sync_answers_503_and_drops_the_event(self):
+        with githook.app.test_request_context():
+            response = githook.receive_push_event(self.push_event, time.time())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(githook.spool.pending(), [])
+
+    def test_spooled_event_is_retried(self):
+        githook.worker_pool = _WorkerPool()
+        event_id = githook.spool.append(self.push_event)
+        githook.process_job(event_id, self.push_event, None)
+        self.assertEqual(len(githook.worker_pool.delayed), 1)
+        (retried_id, push_event, received, attempt), delay = githook.worker_pool.delayed[0]
+        self.assertEqual((retried_id, attempt, delay), (event_id, 1, 1))
+        self.assertEqual([event_id for event_id, push_event in githook.spool.pending()], [event_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ YouTrack 2.0 REST API
 """
 
 import re
+import httplib2
 from xml.dom import Node
 from xml.dom.minidom import Document
 from xml.dom import minidom
@@ -49,6 +50,18 @@ class YouTrackException(Exception):
         Exception.__init__(self, msg)
 
 
+class YouTrackUnavailable(YouTrackException):
+    """ Raised when no response was received for a request, because the connection failed or timed out. Its response
+        has the status 503, so that it is handled like the server answering that it is unavailable.
+    """
+
+    def __init__(self, url, error):
+        self.cause = error
+        response = httplib2.Response({'status': '503'})
+        response.reason = str(error) or error.__class__.__name__
+        YouTrackException.__init__(self, url, response, '')
+
+
 class YouTrackObject(object):
     def __init__(self, xml=None, youtrack=None):
         self.youtrack = youtrack
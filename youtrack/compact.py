@@ -0,0 +1,262 @@
+"""
+Compact representations of the objects that are loaded in bulk: issues, users,
+comments and links.
+
+The classes in youtrack keep every field in the instance __dict__, which costs
+several hundred bytes per object. The classes here store the fields that every
+object has in __slots__; all other fields (custom fields, mostly) are kept in a
+list whose positions are given by a field name table shared by all instances
+of the class. Text values read from XML are stored UTF-8 encoded (short ones
+interned, as most are values like priorities, states and logins) and decoded
+on access, and attachments are only turned into objects when they are asked
+for.
+
+The objects are built from ElementTree elements (see
+youtrack.xmlstream.iter_elements), support the same attribute and item access
+and iteration as the youtrack classes, and can be passed to importIssues,
+importLinks and importUsers.
+"""
+
+import threading
+from xml.dom import minidom
+from xml.etree import cElementTree
+import youtrack
+
+
+class _Lazy(object):
+    """ A value kept in its serialized form until it is accessed """
+    __slots__ = ('data', 'decode')
+
+    def __init__(self, data, decode):
+        self.data = data
+        self.decode = decode
+
+
+class _Unset(object):
+    __slots__ = ()
+
+_UNSET = _Unset()
+
+# text values up to this length are interned
+_INTERN_LENGTH = 32
+
+
+class _TextSlot(object):
+    """ Wraps the descriptor of a slot, text stored UTF-8 encoded in it is decoded when accessed """
+
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj, cls)
+        return value.decode('utf-8') if type(value) is str else value
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+    def __delete__(self, obj):
+        self.slot.__delete__(obj)
+
+
+def _text_slots(cls):
+    for name in cls._slots:
+        setattr(cls, name, _TextSlot(cls.__dict__[name]))
+    return cls
+
+
+def _text(el):
+    """ The text directly inside an element, like YouTrackObject._text """
+    return unicode((el.text or '') + ''.join(c.tail or '' for c in el))
+
+
+class CompactObject(object):
+    __slots__ = ('youtrack', '_values')
+    # the fields stored in slots of a subclass
+    _slots = ()
+
+    # name -> position in _values, one table per class
+    _names = None
+    _names_lock = threading.Lock()
+
+    def __init__(self, el=None, youtrack=None):
+        object.__setattr__(self, 'youtrack', youtrack)
+        object.__setattr__(self, '_values', [])
+        if el is not None:
+            self._update(el)
+
+    def _update(self, el):
+        for name, value in el.attrib.items():
+            setattr(self, name, self._pack(value))
+        for c in el:
+            name = c.get('name')
+            if not name:
+                continue
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            values = c.findall('.//value')
+            if len(values) == 1:
+                setattr(self, name, self._pack(_text(values[0])))
+            elif len(values) > 1:
+                setattr(self, name, [_text(value) for value in values])
+            elif 'value' in c.attrib:
+                setattr(self, name, self._pack(c.get('value')))
+
+    def _pack(self, value):
+        """ The stored form of a text value read from XML. Values that are str are always decoded when accessed. """
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return intern(value) if len(value) <= _INTERN_LENGTH else value
+
+    @classmethod
+    def _position(cls, name, create):
+        if cls._names is None or name not in cls._names:
+            if not create:
+                return None
+            with cls._names_lock:
+                if cls.__dict__.get('_names') is None:
+                    cls._names = {}
+                cls._names.setdefault(name, len(cls._names))
+        return cls._names[name]
+
+    def __getattr__(self, name):
+        # only called for fields that are not set in a slot
+        position = self._position(name, False)
+        values = self._values
+        if position is None or position >= len(values) or values[position] is _UNSET:
+            raise AttributeError(name)
+        value = values[position]
+        if type(value) is str:
+            return value.decode('utf-8')
+        if isinstance(value, _Lazy):
+            value = values[position] = value.decode(value.data, self.youtrack)
+        return value
+
+    def __setattr__(self, name, value):
+        if name in self.__class__._slots or name in CompactObject.__slots__:
+            object.__setattr__(self, name, value)
+            return
+        position = self._position(name, True)
+        values = self._values
+        if position >= len(values):
+            values.extend([_UNSET] * (position + 1 - len(values)))
+        values[position] = value
+
+    def __delattr__(self, name):
+        if name in self.__class__._slots:
+            object.__delattr__(self, name)
+            return
+        position = self._position(name, False)
+        if position is None or position >= len(self._values) or self._values[position] is _UNSET:
+            raise AttributeError(name)
+        self._values[position] = _UNSET
+
+    def _items(self):
+        """ Yields the set fields, values of the non-slot fields as stored """
+        for name in self.__class__._slots:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                yield name, value
+        if self._names is not None:
+            for name, position in self._names.items():
+                if position < len(self._values) and self._values[position] is not _UNSET:
+                    yield name, self._values[position]
+
+    def __iter__(self):
+        for name, value in self._items():
+            if isinstance(value, (basestring, list, _Lazy)) or getattr(value, '__iter__', False):
+                yield name
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        _repr = ''
+        for k, v in self._items():
+            v = getattr(self, k)
+            if isinstance(k, unicode):
+                k = k.encode('utf-8')
+            if isinstance(v, unicode):
+                v = v.encode('utf-8')
+            _repr += k + ' = ' + str(v) + '\n'
+        return _repr
+
+
+def _attachments(data, yt):
+    return [youtrack.Attachment(e, yt) for e in minidom.parseString(data).getElementsByTagName('fileUrl')]
+
+
+@_text_slots
+class CompactIssue(CompactObject):
+    _slots = __slots__ = ('id', 'entityId', 'projectShortName', 'numberInProject', 'summary', 'description',
+                          'created', 'updated', 'updaterName', 'reporterName', 'links')
+
+    def _update(self, el):
+        CompactObject._update(self, el)
+        if el.find('.//links') is not None:
+            self.links = [CompactLink(e, self.youtrack) for e in el.iter('issueLink')]
+        else:
+            self.links = None
+        if el.find('.//attachments') is not None:
+            fileUrls = []
+            for e in el.iter('fileUrl'):
+                e.tail = None
+                fileUrls.append(cElementTree.tostring(e))
+            self.attachments = _Lazy('<attachments>' + ''.join(fileUrls) + '</attachments>', _attachments)
+        else:
+            self.attachments = None
+        for m in ['fixedVersion', 'affectsVersion']: self._normilizeMultiple(m)
+        if hasattr(self, 'fixedInBuild') and (self.fixedInBuild == 'Next build'):
+            self.fixedInBuild = None
+
+    _normilizeMultiple = youtrack.Issue.__dict__['_normilizeMultiple']
+    getReporter = youtrack.Issue.__dict__['getReporter']
+    hasAssignee = youtrack.Issue.__dict__['hasAssignee']
+    getAssignee = youtrack.Issue.__dict__['getAssignee']
+    getUpdater = youtrack.Issue.__dict__['getUpdater']
+    hasVoters = youtrack.Issue.__dict__['hasVoters']
+    getVoters = youtrack.Issue.__dict__['getVoters']
+    getComments = youtrack.Issue.__dict__['getComments']
+    getAttachments = youtrack.Issue.__dict__['getAttachments']
+    getLinks = youtrack.Issue.__dict__['getLinks']
+
+
+@_text_slots
+class CompactUser(CompactObject):
+    _slots = __slots__ = ('login', 'fullName', 'email', 'jabber', 'url')
+
+    def getGroups(self):
+        return []
+
+    __hash__ = youtrack.User.__dict__['__hash__']
+    __cmp__ = youtrack.User.__dict__['__cmp__']
+
+
+@_text_slots
+class CompactComment(CompactObject):
+    _slots = __slots__ = ('id', 'author', 'authorFullName', 'issueId', 'text', 'created', 'updated')
+
+    getAuthor = youtrack.Comment.__dict__['getAuthor']
+
+
+@_text_slots
+class CompactLink(CompactObject):
+    _slots = __slots__ = ('typeName', 'source', 'target', 'typeInward', 'typeOutward')
+
+    def __hash__(self):
+        return hash((self.typeName, self.source, self.target))
+
+    def __eq__(self, other):
+        return isinstance(other, (CompactLink, youtrack.Link)) and self.typeName == other.typeName and \
+               self.source == other.source and self.target == other.target
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
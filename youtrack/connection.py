@@ -1,16 +1,26 @@
 import calendar
 from datetime import datetime
-import httplib2
 from xml.dom import minidom
 import sys
 import youtrack
 from xml.dom import Node
-import urllib2
 import urllib
 from xml.sax.saxutils import escape, quoteattr
 import json
-import urllib2_file
-import tempfile
+import httplib
+import httplib2
+import itertools
+import socket
+import uuid
+import time
+from StringIO import StringIO
+from youtrack.transport import HttpPool
+from youtrack.xmlstream import iter_elements
+from youtrack.paging import iter_pages
+from youtrack.resilience import is_outage
+from youtrack import compact as compact_module
+from youtrack import serialize
+from youtrack import importing
 
 def urlquote(s):
     return urllib.quote(utf8encode(s), safe="")
@@ -20,11 +30,36 @@ def utf8encode(source):
         source = source.encode('utf-8')
     return source
 
+def response_file(url, response, content):
+    """ Wraps a response of the transport into a file-like object like the ones returned by urllib2.urlopen
+    """
+    headers = httplib.HTTPMessage(StringIO(''.join('%s: %s\r\n' % (k, v) for k, v in response.items()
+                                                   if not k.startswith('-'))))
+    return urllib.addinfourl(StringIO(content), headers, url, response.status)
+
 
 class Connection(object):
-    def __init__(self, url, login=None, password=None, proxy_info=None, api_key=None):
-        self.http = httplib2.Http(disable_ssl_certificate_validation=True) if proxy_info is None else httplib2.Http(
-            proxy_info=proxy_info, disable_ssl_certificate_validation=True)
+    # request bodies given as chunks (a function returning an iterable of them, see _request) that are larger than this
+    # are sent while they are produced
+    UPLOAD_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, url, login=None, password=None, proxy_info=None, api_key=None, pool_size=10, idle_timeout=60,
+                 connect_timeout=None, read_timeout=None, page_window=4, breaker=None, retry=None,
+                 limiter=None):
+        # all requests go through this pool of persistent connections; at most
+        # pool_size of them are sent at the same time
+        self.pool = HttpPool(pool_size, idle_timeout, connect_timeout, read_timeout, proxy_info)
+        # the number of pages of a paged list that are requested at once
+        self.page_window = page_window
+        # a youtrack.resilience.CircuitBreaker all requests go through and a
+        # youtrack.resilience.RetryPolicy for failed requests, both optional
+        self.breaker = breaker
+        self.retry = retry
+        # a youtrack.ratelimit.RateLimiter every request waits for, optional
+        self.limiter = limiter
+        # callables notified of every request sent, with the arguments (method, url, status, seconds, size); status
+        # and size are None if no response was received, size is None for streamed responses
+        self.listeners = []
 
         # Remove the last character of the url ends with "/"
         if url:
@@ -32,38 +67,159 @@ class Connection(object):
 
         self.url = url
         self.baseUrl = url + "/rest"
+        self._credentials = None
         if api_key is None:
             self._login(login, password)
         else:
             self.headers = {'X-YouTrack-ApiKey': api_key}
 
     def _login(self, login, password):
-        response, content = self.http.request(
+        response, content = self._send('POST', '/user/login', lambda: self.pool.request(
             self.baseUrl + "/user/login?login=" + urllib.quote_plus(login) + "&password=" + urllib.quote_plus(password),
             'POST',
-            headers={'Content-Length': '0', 'Connection': 'keep-alive'})
+            headers={'Content-Length': '0', 'Connection': 'keep-alive'}))
         if response.status != 200:
             raise youtrack.YouTrackException('/user/login', response, content)
         self.headers = {'Cookie': response['set-cookie'],
                         'Cache-Control': 'no-cache'}
+        self._credentials = (login, password)
 
         #print responsetes
 
 
     def _req(self, method, url, body=None, ignoreStatus=None):
+        response, content = self._relogin(lambda: self._request(method, url, body))
+        if response.status != 200 and response.status != 201 and (ignoreStatus != response.status):
+            raise youtrack.YouTrackException(url, response, content)
+
+        #print response
+
+        return response, content
+
+    def _relogin(self, request):
+        """ Returns request(), which sends a request and returns (response, content), calling it once more after
+            logging in again if the session cookie has expired.
+        """
+        response, content = request()
+        if response.status == 401 and self._credentials is not None:
+            self._login(*self._credentials)
+            response, content = request()
+        return response, content
+
+    def _request(self, method, url, body=None):
+        if callable(body):
+            return self._send(method, url, lambda: self._requestChunks(method, url, body()))
         headers = self.headers
         if method == 'PUT' or method == 'POST':
             headers = headers.copy()
             headers['Content-Type'] = 'application/xml; charset=UTF-8'
             headers['Content-Length'] = str(len(body)) if body else '0'
 
-        response, content = self.http.request((self.baseUrl + url).encode('utf-8'), method, headers=headers, body=body)
-        if response.status != 200 and response.status != 201 and (ignoreStatus != response.status):
-            raise youtrack.YouTrackException(url, response, content)
+        return self._send(method, url, lambda: self.pool.request((self.baseUrl + url).encode('utf-8'), method,
+                                                                 headers=headers, body=body))
 
-        #print response
+    def _requestChunks(self, method, url, chunks):
+        """ Sends a request whose body is given as an iterable of chunks. Bodies of up to UPLOAD_BUFFER_SIZE bytes are
+            sent like any other, larger ones while the chunks are produced, with chunked transfer encoding.
+        """
+        uri = (self.baseUrl + url).encode('utf-8')
+        headers = self.headers.copy()
+        headers['Content-Type'] = 'application/xml; charset=UTF-8'
+        chunks = iter(chunks)
+        buffered = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > self.UPLOAD_BUFFER_SIZE:
+                return self.pool.upload(uri, method, itertools.chain(buffered, chunks), headers)
+        body = ''.join(buffered)
+        headers['Content-Length'] = str(len(body)) if body else '0'
+        return self.pool.request(uri, method, headers=headers, body=body)
+
+    def _send(self, method, url, send, stream=False):
+        """ Returns send(), which sends a request and returns (response, content), passing the request through the
+            circuit breaker and the rate limiter and retrying it if the retry policy allows. If stream is set, content
+            is a file-like object. Errors of the transport, such as a refused connection, are raised as
+            youtrack.YouTrackUnavailable once they are not retried.
+        """
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.before()
+            if self.limiter is not None:
+                self.limiter.acquire(method, url)
+            started = time.time()
+            try:
+                response, content = send()
+            except Exception, e:
+                self._notify(method, url, None, started, None)
+                if self.breaker is not None:
+                    self.breaker.record(True, time.time() - started)
+                if self.retry is None or not self.retry.retries_error(method, e, attempt):
+                    if isinstance(e, (socket.error, httplib.HTTPException, httplib2.HttpLib2Error)):
+                        raise youtrack.YouTrackUnavailable(url, e), None, sys.exc_info()[2]
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                size = None if stream else len(content) if content is not None else 0
+                self._notify(method, url, response.status, started, size)
+                if self.breaker is not None:
+                    self.breaker.record(is_outage(response.status), time.time() - started)
+                if self.retry is None or not self.retry.retries_status(method, response.status, attempt):
+                    return response, content
+                if stream:
+                    content.close()
+                delay = self.retry.delay(attempt, response.get('retry-after'))
+            attempt += 1
+            time.sleep(delay)
+
+    def _notify(self, method, url, status, started, size):
+        if not self.listeners:
+            return
+        seconds = time.time() - started
+        for listener in self.listeners:
+            listener(method, url, status, seconds, size)
 
-        return response, content
+    def _streamRequest(self, url):
+        return self._send('GET', url, lambda: self.pool.stream((self.baseUrl + url).encode('utf-8'),
+                                                              headers=self.headers), stream=True)
+
+    def _stream(self, url):
+        """ Sends a GET request and returns a file-like object from which the response can be read while it is
+            downloaded. The caller must close it.
+        """
+        response, body = self._streamRequest(url)
+        if response.status == 401 and self._credentials is not None:
+            body.close()
+            self._login(*self._credentials)
+            response, body = self._streamRequest(url)
+        if response.status != 200:
+            content = body.read()
+            body.close()
+            raise youtrack.YouTrackException(url, response, content)
+        return body
+
+    def _iterXml(self, url, factory, tag=None, dom=True):
+        """ Yields factory(element, self) for every element of the XML list returned for url, parsing the list while
+            it is downloaded. The elements are minidom elements, or ElementTree elements if dom is False. The request
+            is sent on a connection of its own, so this is meant for lists of unbounded size, such as exports; see
+            _getXmlList for the others.
+        """
+        body = self._stream(url)
+        try:
+            for e in iter_elements(body, tag, dom):
+                yield factory(e, self)
+        finally:
+            body.close()
+
+    def _getXmlList(self, url, factory, tag=None, dom=True):
+        """ Returns the list of factory(element, self) for the elements of the XML list returned for url, like
+            _iterXml, but downloads the list completely before parsing it, on one of the persistent connections of the
+            pool. For lists of bounded size, such as the comments of an issue or a page of a paged list.
+        """
+        response, content = self._req('GET', url)
+        return [factory(e, self) for e in iter_elements(StringIO(content), tag, dom)]
 
     def _reqXml(self, method, url, body=None, ignoreStatus=None):
         response, content = self._req(method, url, body, ignoreStatus)
@@ -120,13 +276,19 @@ class Connection(object):
         return self._reqXml('PUT', '/issue?' + urllib.urlencode(params), '')
 
     def get_changes_for_issue(self, issue):
-        return [youtrack.IssueChange(change, self) for change in
-                self._get("/issue/%s/changes" % issue).getElementsByTagName('change')]
+        return list(self.iter_changes_for_issue(issue))
 
-    def getComments(self, id):
-        response, content = self._req('GET', '/issue/' + id + '/comment')
-        xml = minidom.parseString(content)
-        return [youtrack.Comment(e, self) for e in xml.documentElement.childNodes if e.nodeType == Node.ELEMENT_NODE]
+    def iter_changes_for_issue(self, issue):
+        return iter(self._getXmlList("/issue/%s/changes" % issue, youtrack.IssueChange, 'change'))
+
+    def getComments(self, id, compact=False):
+        return list(self.iterComments(id, compact))
+
+    def iterComments(self, id, compact=False):
+        """ If compact is set, yields youtrack.compact.CompactComment objects """
+        if compact:
+            return iter(self._getXmlList('/issue/' + id + '/comment', compact_module.CompactComment, dom=False))
+        return iter(self._getXmlList('/issue/' + id + '/comment', youtrack.Comment))
 
     def getAttachments(self, id):
         response, content = self._req('GET', '/issue/' + id + '/attachment')
@@ -134,8 +296,14 @@ class Connection(object):
         return [youtrack.Attachment(e, self) for e in xml.documentElement.childNodes if e.nodeType == Node.ELEMENT_NODE]
 
     def getAttachmentContent(self, url):
-        f = urllib2.urlopen(urllib2.Request(self.url + url, headers=self.headers))
-        return f
+        """ Returns a file-like object with the attachment's content, its headers
+            are available through info()
+        """
+        response, content = self._relogin(lambda: self._send('GET', url, lambda: self.pool.request(
+            self.url + url, 'GET', headers=self.headers)))
+        if response.status != 200:
+            raise youtrack.YouTrackException(url, response, content)
+        return response_file(self.url + url, response, content)
 
     def createAttachmentFromAttachment(self, issueId, a):
         try:
@@ -148,10 +316,10 @@ class Connection(object):
                 contentType=content.info().type,
                 created=a.created if hasattr(a, 'created') else None,
                 group=a.group if hasattr(a, 'group') else '')
-        except urllib2.HTTPError, e:
+        except youtrack.YouTrackException, e:
             print "Can't create attachment"
             try:
-                err_content = e.read()
+                err_content = e.content
                 issue_id = issueId
                 attach_name = a.name
                 attach_url = a.url
@@ -163,7 +331,7 @@ class Connection(object):
                     attach_name = attach_name.encode('utf-8')
                 if isinstance(attach_url, unicode):
                     attach_url = attach_url.encode('utf-8')
-                print "HTTP CODE: ", e.code
+                print "HTTP CODE: ", e.response.status
                 print "REASON: ", err_content
                 print "IssueId: ", issue_id
                 print "Attachment filename: ", attach_name
@@ -182,21 +350,6 @@ class Connection(object):
 
     def _process_attachmnets(self, authorLogin, content, contentLength, contentType, created, group, issueId, name,
                              url_prefix='/issue/'):
-        if contentType is not None:
-            content.contentType = contentType
-        if contentLength is not None:
-            content.contentLength = contentLength
-        else:
-            tmp = tempfile.NamedTemporaryFile()
-            tmp.write(content.read())
-            tmp.flush()
-            tmp.seek(0)
-            content = tmp
-
-        #post_data = {'attachment': content}
-        post_data = {name: content}
-        headers = self.headers.copy()
-        #headers['Content-Type'] = contentType
         # name without extension to workaround: http://youtrack.jetbrains.net/issue/JT-6110
         params = {#'name': os.path.splitext(name)[0],
                   'authorLogin': authorLogin,
@@ -211,17 +364,30 @@ class Connection(object):
             except youtrack.YouTrackException:
                 params['created'] = str(calendar.timegm(datetime.now().timetuple()) * 1000)
 
+        boundary = '----------' + uuid.uuid4().hex
+        body = '\r\n'.join([
+            '--' + boundary,
+            'Content-Disposition: form-data; name=%s; filename=%s' % (quoteattr(utf8encode(name)),
+                                                                     quoteattr(utf8encode(name))),
+            'Content-Type: ' + (contentType or 'application/octet-stream'),
+            '',
+            content.read(),
+            '--' + boundary + '--',
+            ''])
         url = self.baseUrl + url_prefix + issueId + "/attachment?" + urllib.urlencode(params)
-        r = urllib2.Request(url,
-            headers=headers, data=post_data)
-        #r.set_proxy('localhost:8888', 'http')
-        try:
-            res = urllib2.urlopen(r)
-        except urllib2.HTTPError, e:
-            if e.code == 201:
-                return e.msg + ' ' + name
-            raise e
-        return res
+
+        def send():
+            headers = self.headers.copy()
+            headers['Content-Type'] = 'multipart/form-data; boundary=' + boundary
+            headers['Content-Length'] = str(len(body))
+            return self.pool.request(url, 'POST', body=body, headers=headers)
+        response, response_content = self._relogin(lambda: self._send('POST', url_prefix + issueId + "/attachment",
+                                                                      send))
+        if response.status == 201:
+            return 'Created ' + name
+        if response.status != 200:
+            raise youtrack.YouTrackException(url_prefix + issueId + "/attachment", response, response_content)
+        return response_file(url, response, response_content)
 
     def createAttachment(self, issueId, name, content, authorLogin='', contentType=None, contentLength=None,
                          created=None, group=''):
@@ -272,16 +438,8 @@ class Connection(object):
         """
         if len(users) <= 0: return
 
-        known_attrs = ('login', 'fullName', 'email', 'jabber')
-
-        xml = '<list>\n'
-        for u in users:
-            xml += '  <user ' + "".join(k + '=' + quoteattr(u[k]) + ' ' for k in u if k in known_attrs) + '/>\n'
-        xml += '</list>'
         #TODO: convert response xml into python objects
-        if isinstance(xml, unicode):
-            xml = xml.encode('utf-8')
-        return self._reqXml('PUT', '/import/users', xml, 400).toxml()
+        return self._reqXml('PUT', '/import/users', lambda: serialize.users_xml(users), 400).toxml()
 
     def importIssuesXml(self, projectId, assigneeGroup, xml):
         return self._reqXml('PUT', '/import/' + urlquote(projectId) + '/issues?' +
@@ -294,27 +452,12 @@ class Connection(object):
             Example: importLinks([{'login':'vadim', 'fullName':'vadim', 'email':'eee@ss.com', 'jabber':'fff@fff.com'},
                                   {'login':'maxim', 'fullName':'maxim', 'email':'aaa@ss.com', 'jabber':'www@fff.com'}])
         """
-        xml = '<list>\n'
-        for l in links:
-            # ignore typeOutward and typeInward returned by getLinks()
-            xml += '  <link ' + "".join(attr + '=' + quoteattr(l[attr]) +
-                                        ' ' for attr in l if attr not in ['typeInward', 'typeOutward']) + '/>\n'
-        xml += '</list>'
         #TODO: convert response xml into python objects
-        res = self._reqXml('PUT', '/import/links', xml, 400)
+        res = self._reqXml('PUT', '/import/links', lambda: serialize.links_xml(links), 400)
         return res.toxml() if hasattr(res, "toxml") else res
 
-    def importIssues(self, projectId, assigneeGroup, issues):
-        """ Import issues, returns import result (http://confluence.jetbrains.net/display/YTD2/Import+Issues)
-            Accepts retrun of getIssues()
-            Example: importIssues([{'numberInProject':'1', 'summary':'some problem', 'description':'some description', 'priority':'1',
-                                    'fixedVersion':['1.0', '2.0'],
-                                    'comment':[{'author':'yamaxim', 'text':'comment text', 'created':'1267030230127'}]},
-                                   {'numberInProject':'2', 'summary':'some problem', 'description':'some description', 'priority':'1'}])
-        """
-        if len(issues) <= 0:
-            return
-
+    def _importBadFields(self, projectId):
+        """ Returns the fields of issues that are not imported """
         bad_fields = ['id', 'projectShortName', 'votes', 'commentsCount',
                       'historyUpdated', 'updatedByFullName', 'updaterFullName',
                       'reporterFullName', 'links', 'attachments', 'jiraId']
@@ -322,65 +465,29 @@ class Connection(object):
         tt_settings = self.getProjectTimeTrackingSettings(projectId)
         if tt_settings and tt_settings.Enabled and tt_settings.TimeSpentField:
             bad_fields.append(tt_settings.TimeSpentField)
+        return bad_fields
 
-        xml = '<issues>\n'
-        issue_records = dict([])
-
-
-        for issue in issues:
-            record = ""
-            record += '  <issue>\n'
-
-            comments = None
-            if getattr(issue, "getComments", None):
-                comments = issue.getComments()
+    def _importIssuesXml(self, projectId, issues):
+        """ Returns a function returning the XML document importing the issues as a generator of chunks, and a function
+            returning the record of the issue with the given numberInProject in the document
+        """
+        bad_fields = self._importBadFields(projectId)
+        by_number = dict((issue.numberInProject, issue) for issue in issues)
+        return (lambda: serialize.issues_xml(issues, bad_fields),
+                lambda number: serialize.issue_record(by_number[number], bad_fields))
 
-            for issueAttr in issue:
-                attrValue = issue[issueAttr]
-                if attrValue is None:
-                    continue
-                if isinstance(attrValue, unicode):
-                    attrValue = attrValue.encode('utf-8')
-                if isinstance(issueAttr, unicode):
-                    issueAttr = issueAttr.encode('utf-8')
-                if issueAttr == 'comments':
-                    comments = attrValue
-                else:
-                    # ignore bad fields from getIssue()
-                    if issueAttr not in bad_fields:
-                        record += '    <field name="' + issueAttr + '">\n'
-                        if isinstance(attrValue, list) or getattr(attrValue, '__iter__', False):
-                            for v in attrValue:
-                                if isinstance(v, unicode):
-                                    v = v.encode('utf-8')
-                                record += '      <value>' + escape(v.strip()) + '</value>\n'
-                        else:
-                            record += '      <value>' + escape(attrValue.strip()) + '</value>\n'
-                        record += '    </field>\n'
-
-            if comments:
-                for comment in comments:
-                    record += '    <comment'
-                    for ca in comment:
-                        val = comment[ca]
-                        if isinstance(ca, unicode):
-                            ca = ca.encode('utf-8')
-                        if isinstance(val, unicode):
-                            val = val.encode('utf-8')
-                        record += ' ' + ca + '=' + quoteattr(val)
-                    record += '/>\n'
-
-            record += '  </issue>\n'
-            xml += record
-            issue_records[issue.numberInProject] = record
-
-        xml += '</issues>'
-
-        #print xml
-        #TODO: convert response xml into python objects
+    def importIssues(self, projectId, assigneeGroup, issues):
+        """ Import issues, returns import result (http://confluence.jetbrains.net/display/YTD2/Import+Issues)
+            Accepts retrun of getIssues(). For large imports and structured results see importIssuesInBatches.
+            Example: importIssues([{'numberInProject':'1', 'summary':'some problem', 'description':'some description', 'priority':'1',
+                                    'fixedVersion':['1.0', '2.0'],
+                                    'comment':[{'author':'yamaxim', 'text':'comment text', 'created':'1267030230127'}]},
+                                   {'numberInProject':'2', 'summary':'some problem', 'description':'some description', 'priority':'1'}])
+        """
+        if len(issues) <= 0:
+            return
 
-        if isinstance(xml, unicode):
-            xml = xml.encode('utf-8')
+        xml, issue_record = self._importIssuesXml(projectId, issues)
 
         if isinstance(assigneeGroup, unicode):
             assigneeGroup = assigneeGroup.encode('utf-8')
@@ -390,15 +497,20 @@ class Connection(object):
             url = url.encode('utf-8')
         result = self._reqXml('PUT', url, xml, 400)
         if (result == "") and (len(issues) > 1):
-            for issue in issues:
-                self.importIssues(projectId, assigneeGroup, [issue])
+            # find the issues the import fails on by halving the batch
+            middle = len(issues) // 2
+            self.importIssues(projectId, assigneeGroup, issues[:middle])
+            self.importIssues(projectId, assigneeGroup, issues[middle:])
+            return ""
         response = ""
         try:
             response = result.toxml().encode('utf-8')
         except:
             sys.stderr.write("can't parse response")
-            sys.stderr.write("request was")
-            sys.stderr.write(xml)
+            if len(issues) == 1:
+                # only the request of the issue the import fails on
+                sys.stderr.write("request was")
+                sys.stderr.writelines(xml())
             return response
         item_elements = minidom.parseString(response).getElementsByTagName("item")
         if len(item_elements) != len(issues):
@@ -415,13 +527,35 @@ class Connection(object):
                     sys.stderr.write("Reason : ")
                     sys.stderr.write(item.toxml())
                     sys.stderr.write("Request was :")
-                    if isinstance(issue_records[id], unicode):
-                        sys.stderr.write(issue_records[id].encode('utf-8'))
-                    else:
-                        sys.stderr.write(issue_records[id])
+                    sys.stderr.write(issue_record(id))
                 print ""
         return response
 
+    def importIssuesInBatches(self, projectId, assigneeGroup, issues, max_issues=100, max_bytes=4 * 1024 * 1024,
+                              threads=4):
+        """ Import issues with a request per batch of at most max_issues issues and max_bytes bytes of XML, sending up
+            to threads batches at once (assigneeGroup may be None). A batch that fails as a whole is halved until the
+            issues it fails on are found. Returns a youtrack.importing.IssueImportResult for every issue, in order.
+        """
+        bad_fields = self._importBadFields(projectId)
+        url = '/import/' + urlquote(projectId) + '/issues'
+        if assigneeGroup is not None:
+            url += '?' + urllib.urlencode({'assigneeGroup': utf8encode(assigneeGroup)})
+
+        def send(batch):
+            response, content = self._req('PUT', url, lambda: serialize.records_xml(record for number, record in batch),
+                                          400)
+            if response.status == 400:
+                raise youtrack.YouTrackException(url, response, content)
+            reasons = {}
+            for item in minidom.parseString(content).getElementsByTagName('item'):
+                reasons[item.getAttribute('id')] = None if item.getAttribute('imported').lower() == 'true' \
+                    else item.toxml()
+            return reasons
+
+        records = ((issue.numberInProject, serialize.issue_record(issue, bad_fields)) for issue in issues)
+        return importing.import_batches(send, importing.batches(records, max_issues, max_bytes), threads)
+
     def getProjects(self):
         projects = {}
         for e in self._get("/project/all").documentElement.childNodes:
@@ -447,9 +581,10 @@ class Connection(object):
         return youtrack.Group(self._get("/admin/group/" + urlquote(name.encode('utf-8'))), self)
 
     def getGroups(self):
-        response, content = self._req('GET', '/admin/group')
-        xml = minidom.parseString(content)
-        return [youtrack.Group(e, self) for e in xml.documentElement.childNodes if e.nodeType == Node.ELEMENT_NODE]
+        return list(self.iterGroups())
+
+    def iterGroups(self):
+        return iter(self._getXmlList('/admin/group', youtrack.Group))
 
     def deleteGroup(self, name):
         return self._req('DELETE', "/admin/group/" + urlquote(name.encode('utf-8')))
@@ -552,19 +687,20 @@ class Connection(object):
         return [youtrack.Build(e, self) for e in xml.documentElement.childNodes if e.nodeType == Node.ELEMENT_NODE]
 
 
-    def getUsers(self, params={}):
-        first = True
-        users = []
-        position = 0
+    def getUsers(self, params={}, compact=False):
+        return list(self.iterUsers(params, compact))
+
+    def iterUsers(self, params={}, compact=False):
+        """ If compact is set, yields youtrack.compact.CompactUser objects. The pages of ten users are requested
+            page_window at a time.
+        """
         user_search_params = urllib.urlencode(params)
-        while True:
-            response, content = self._req('GET', "/admin/user/?start=%s&%s" % (str(position), user_search_params))
-            position += 10
-            xml = minidom.parseString(content)
-            newUsers = [youtrack.User(e, self) for e in xml.documentElement.childNodes if
-                        e.nodeType == Node.ELEMENT_NODE]
-            if not len(newUsers): return users
-            users += newUsers
+        factory = compact_module.CompactUser if compact else youtrack.User
+
+        def fetch_page(position):
+            return self._getXmlList("/admin/user/?start=%s&%s" % (str(position), user_search_params), factory,
+                                    dom=not compact)
+        return iter_pages(fetch_page, 10, window=self.page_window, page_size=10)
 
 
     def getUsersTen(self, start):
@@ -655,19 +791,49 @@ class Connection(object):
             '/admin/project/' + urlquote(projectId) + '/version/' + urlquote(name.encode('utf-8')) + "?" +
             urllib.urlencode(params))
 
-    def getIssues(self, projectId, filter, after, max):
-        #response, content = self._req('GET', '/project/issues/' + urlquote(projectId) + "?" +
-        response, content = self._req('GET', '/issue/byproject/' + urlquote(projectId) + "?" +
-                                             urllib.urlencode({'after': str(after),
-                                                               'max': str(max),
-                                                               'filter': filter}))
-        xml = minidom.parseString(content)
-        return [youtrack.Issue(e, self) for e in xml.documentElement.childNodes if e.nodeType == Node.ELEMENT_NODE]
+    def getIssues(self, projectId, filter, after, max, compact=False):
+        """ If compact is set, returns youtrack.compact.CompactIssue objects """
+        url = '/issue/byproject/' + urlquote(projectId) + "?" + urllib.urlencode({'after': str(after),
+                                                                                  'max': str(max),
+                                                                                  'filter': filter})
+        if compact:
+            return self._getXmlList(url, compact_module.CompactIssue, dom=False)
+        return self._getXmlList(url, youtrack.Issue)
+
+    def iterIssues(self, projectId, filter, after, max, compact=False):
+        """ Like getIssues, but parses the issues while they are downloaded, for large values of max. If compact is
+            set, yields youtrack.compact.CompactIssue objects.
+        """
+        #url = '/project/issues/' + urlquote(projectId) + "?" +
+        url = '/issue/byproject/' + urlquote(projectId) + "?" + urllib.urlencode({'after': str(after),
+                                                                                  'max': str(max),
+                                                                                  'filter': filter})
+        if compact:
+            return self._iterXml(url, compact_module.CompactIssue, dom=False)
+        return self._iterXml(url, youtrack.Issue)
+
+    def iterAllIssues(self, projectId, filter='', after=0, pageSize=100, compact=False):
+        """ Yields the issues of the project matching filter, starting with the one at position after, requesting
+            pages of pageSize issues page_window at a time. If compact is set, yields youtrack.compact.CompactIssue
+            objects.
+        """
+        factory = compact_module.CompactIssue if compact else youtrack.Issue
 
-    def exportIssueLinks(self):
-        response, content = self._req('GET', '/export/links')
-        xml = minidom.parseString(content)
-        return [youtrack.Link(e, self) for e in xml.documentElement.childNodes if e.nodeType == Node.ELEMENT_NODE]
+        def fetch_page(position):
+            url = '/issue/byproject/' + urlquote(projectId) + "?" + urllib.urlencode({'after': str(position),
+                                                                                      'max': str(pageSize),
+                                                                                      'filter': filter})
+            return self._getXmlList(url, factory, dom=not compact)
+        return iter_pages(fetch_page, pageSize, after, self.page_window)
+
+    def exportIssueLinks(self, compact=False):
+        return list(self.iterIssueLinks(compact))
+
+    def iterIssueLinks(self, compact=False):
+        """ If compact is set, yields youtrack.compact.CompactLink objects """
+        if compact:
+            return self._iterXml('/export/links', compact_module.CompactLink, dom=False)
+        return self._iterXml('/export/links', youtrack.Link)
 
     def executeCommand(self, issueId, command, comment=None, group=None, run_as=None):
         if isinstance(command, unicode):
@@ -804,21 +970,10 @@ class Connection(object):
             '/issue/%s/timetracking/workitem' % urlquote(issue_id), xml)
 
     def importWorkItems(self, issue_id, work_items):
-        xml = ''
-        for work_item in work_items:
-            xml +=  '<workItem>'
-            xml += '<date>%s</date>' % work_item.date
-            xml += '<duration>%s</duration>' % work_item.duration
-            if hasattr(work_item, 'description') and work_item.description is not None:
-                xml += '<description>%s</description>' % escape(work_item.description)
-            xml += '<author login=%s></author>' % quoteattr(work_item.authorLogin)
-            xml += '</workItem>'
-        if isinstance(xml, unicode):
-            xml = xml.encode('utf-8')
-        if xml:
-            xml = '<workItems>' + xml + '</workItems>'
+        work_items = list(work_items)
+        if work_items:
             self._reqXml('PUT',
-                '/import/issue/%s/workitems' % urlquote(issue_id), xml)
+                '/import/issue/%s/workitems' % urlquote(issue_id), lambda: serialize.work_items_xml(work_items))
 
     def getSearchIntelliSense(self, query,
                               context=None, caret=None, options_limit=None):
@@ -977,10 +1132,9 @@ class Connection(object):
         return self.deleteBundle(self.getEnumBundle(name))
 
     def createEnumBundleDetailed(self, name, values):
-        xml = '<enumeration name=\"' + name.encode('utf-8') + '\">'
-        xml += ' '.join('<value>' + v + '</value>' for v in values)
-        xml += '</enumeration>'
-        return self._reqXml('PUT', '/admin/customfield/bundle', body=xml.encode('utf8'), ignoreStatus=400)
+        values = list(values)
+        return self._reqXml('PUT', '/admin/customfield/bundle', body=lambda: serialize.enum_bundle_xml(name, values),
+                            ignoreStatus=400)
 
     def addValueToEnumBundle(self, name, value):
         return self.addValueToBundle(self.getEnumBundle(name), value)
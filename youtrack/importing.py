@@ -0,0 +1,98 @@
+"""
+Import of issues in batches: the issues are split into batches bounded by
+their number and the size of their XML, which are sent in parallel. A batch
+that YouTrack rejects as a whole is halved until the issues it fails on are
+found.
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+from youtrack import YouTrackException
+from youtrack.resilience import is_outage
+
+
+class IssueImportResult(object):
+    """ The outcome of importing an issue: imported is True if it was imported, else reason is the <item> element
+        YouTrack answered with or the error the request failed with.
+    """
+
+    def __init__(self, numberInProject, imported, reason=None):
+        self.numberInProject = numberInProject
+        self.imported = imported
+        self.reason = reason
+
+    def __repr__(self):
+        if self.imported:
+            return '<IssueImportResult %s: imported>' % self.numberInProject
+        return '<IssueImportResult %s: %s>' % (self.numberInProject, self.reason)
+
+
+def batches(records, max_issues, max_bytes):
+    """ Splits an iterable of (numberInProject, record) pairs into lists of at most max_issues of them, whose records
+        are at most max_bytes long in total (a larger record makes up a batch of its own)
+    """
+    batch = []
+    size = 0
+    for number, record in records:
+        if batch and (len(batch) >= max_issues or size + len(record) > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append((number, record))
+        size += len(record)
+    if batch:
+        yield batch
+
+
+def import_batches(send, batches, threads):
+    """ Calls send(batch) for every batch from up to threads threads at once, and returns the IssueImportResult of
+        every issue, in the order of the batches. send returns a dict mapping the numberInProject (as unicode) of the
+        issues YouTrack reported on to None if the issue was imported, else to the reason. If it raises
+        YouTrackException for anything but an unavailable server, the batch is halved; other errors fail all issues
+        of the batch.
+    """
+    results = {}
+    numbers = []
+    lock = threading.Lock()
+    # at most this many batches are serialized and not yet imported
+    slots = threading.BoundedSemaphore(threads * 2)
+
+    def run(batch):
+        try:
+            batch_results = _import(send, batch)
+        finally:
+            slots.release()
+        with lock:
+            for result in batch_results:
+                results[result.numberInProject] = result
+
+    pool = ThreadPool(threads)
+    try:
+        for batch in batches:
+            slots.acquire()
+            numbers.extend(number for number, record in batch)
+            pool.apply_async(run, (batch,))
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+    return [results[number] for number in numbers]
+
+
+def _import(send, batch):
+    try:
+        reasons = send(batch)
+    except YouTrackException, e:
+        if is_outage(e.response.status):
+            return [IssueImportResult(number, False, e) for number, record in batch]
+        if len(batch) == 1:
+            return [IssueImportResult(batch[0][0], False, e)]
+        middle = len(batch) // 2
+        return _import(send, batch[:middle]) + _import(send, batch[middle:])
+    except Exception, e:
+        return [IssueImportResult(number, False, e) for number, record in batch]
+    results = []
+    for number, record in batch:
+        reason = reasons.get(unicode(number), 'No result for the issue')
+        results.append(IssueImportResult(number, reason is None, reason))
+    return results
@@ -0,0 +1,87 @@
+"""
+Concurrent fetching of the paged lists of the YouTrack REST API (the ones
+taking a start or after offset).
+"""
+
+import sys
+import threading
+
+
+def iter_pages(fetch_page, step, start=0, window=4, page_size=None):
+    """ Yields the items of the pages returned by fetch_page(offset) for the offsets start, start + step, ... in order,
+        until the first empty page (or the first page with fewer than page_size items, if given).
+
+        Up to window pages are requested at the same time, each by a thread of its own, and at most window pages are
+        requested or waiting ahead of the one being consumed. The window opens gradually, one page is requested
+        first, so that short lists don't cost more requests than fetching them one page after another. Pages past
+        the end may have been requested when the iteration stops, their results are dropped. An exception raised by
+        fetch_page is raised by the iterator once the items of the pages before have been yielded.
+    """
+    if window <= 1:
+        offset = start
+        while True:
+            items = list(fetch_page(offset))
+            for item in items:
+                yield item
+            if not items or (page_size is not None and len(items) < page_size):
+                return
+            offset += step
+
+    condition = threading.Condition()
+    results = {}
+    # next: the next page to request, taken: the number of pages consumed,
+    # end: the index of the last page (or None if not known yet)
+    state = {'next': 0, 'taken': 0, 'end': None, 'closed': False}
+
+    def can_request():
+        if state['closed'] or (state['end'] is not None and state['next'] > state['end']):
+            return False
+        return state['next'] < state['taken'] + min(window, state['taken'] + 1)
+
+    def run():
+        while True:
+            with condition:
+                while not can_request():
+                    if state['closed'] or (state['end'] is not None and state['next'] > state['end']):
+                        return
+                    condition.wait()
+                index = state['next']
+                state['next'] += 1
+            try:
+                result = (True, list(fetch_page(start + index * step)))
+                last = not result[1] or (page_size is not None and len(result[1]) < page_size)
+            except Exception:
+                result = (False, sys.exc_info())
+                last = True
+            with condition:
+                results[index] = result
+                if last and (state['end'] is None or index < state['end']):
+                    state['end'] = index
+                condition.notify_all()
+
+    for i in range(window):
+        thread = threading.Thread(target=run, name='youtrack-page-%d' % i)
+        thread.daemon = True
+        thread.start()
+
+    index = 0
+    try:
+        while True:
+            with condition:
+                while index not in results:
+                    condition.wait()
+                ok, value = results.pop(index)
+                state['taken'] = index + 1
+                condition.notify_all()
+            if not ok:
+                raise value[0], value[1], value[2]
+            for item in value:
+                yield item
+            if index == state['end']:
+                return
+            index += 1
+    finally:
+        with condition:
+            state['closed'] = True
+            results.clear()
+            condition.notify_all()
@@ -0,0 +1,125 @@
+"""
+Client-side rate limiting of the requests sent to YouTrack.
+"""
+
+import fcntl
+import os
+import struct
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allows `rate` requests per second on average and bursts of up to
+    `burst` requests, for the threads of one process.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for it if there is none, and return the
+        number of seconds waited.
+        """
+        with self._lock:
+            wait = self._take(self._load)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _take(self, load):
+        # a token that isn't there yet is reserved by going below zero, so
+        # that callers are served in the order they came
+        tokens, updated = load()
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * self.rate) - 1
+        self._store(tokens, now)
+        return -tokens / self.rate if tokens < 0 else 0
+
+    def _load(self):
+        return self._tokens, self._updated
+
+    def _store(self, tokens, updated):
+        self._tokens = tokens
+        self._updated = updated
+
+
+class SharedTokenBucket(TokenBucket):
+    """A `TokenBucket` whose state is kept in the file at `path`, at the given
+    slot, so that it is shared by all processes of a host using that file.
+    """
+
+    _FORMAT = '=dd'
+    _SIZE = struct.calcsize(_FORMAT)
+
+    def __init__(self, rate, burst, path, slot=0):
+        TokenBucket.__init__(self, rate, burst)
+        self.path = path
+        self._offset = slot * self._SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+
+    def acquire(self):
+        with self._lock:
+            # the file lock excludes other processes, the thread lock other
+            # threads of this one
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._SIZE, self._offset)
+            try:
+                wait = self._take(self._read)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._SIZE, self._offset)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _read(self):
+        os.lseek(self._fd, self._offset, os.SEEK_SET)
+        data = os.read(self._fd, self._SIZE)
+        if len(data) < self._SIZE:
+            # new file, start with a full bucket
+            return self.burst, time.time()
+        return struct.unpack(self._FORMAT, data)
+
+    def _store(self, tokens, updated):
+        os.lseek(self._fd, self._offset, os.SEEK_SET)
+        os.write(self._fd, struct.pack(self._FORMAT, tokens, updated))
+
+
+class RateLimiter(object):
+    """Limits the requests of each endpoint class: reads (GET) and commands
+    (everything that changes something). `rates` maps each class to a `(rate,
+    burst)` pair; classes that aren't given or have a rate of 0 are not
+    limited. If `path` is given, the budgets are shared by all processes using
+    the same file.
+    """
+
+    CLASSES = ('read', 'command')
+
+    def __init__(self, rates, path=None):
+        self.buckets = {}
+        for slot, name in enumerate(self.CLASSES):
+            rate, burst = rates.get(name, (0, 0))
+            if rate:
+                burst = max(burst, 1)
+                self.buckets[name] = SharedTokenBucket(rate, burst, path, slot) if path else TokenBucket(rate, burst)
+        # callables notified of every wait for a token, with the arguments
+        # (endpoint class, seconds)
+        self.listeners = []
+
+    @staticmethod
+    def classify(method, url):
+        return 'read' if method in ('GET', 'HEAD') else 'command'
+
+    def acquire(self, method, url):
+        """Wait until a request may be sent, and return the seconds waited."""
+        name = self.classify(method, url)
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return 0
+        waited = bucket.acquire()
+        for listener in self.listeners:
+            listener(name, waited)
+        return waited
@@ -0,0 +1,166 @@
+"""
+Protection of the callers of a YouTrack connection against an unavailable
+server: a circuit breaker and a retry policy with exponential backoff.
+"""
+
+import errno
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the circuit breaker is open,
+    i.e. the server is considered to be unavailable.
+    """
+
+    def __init__(self, retry_after):
+        # seconds until the next request is let through to probe the server
+        self.retry_after = retry_after
+        Exception.__init__(self, 'YouTrack is unavailable, not sending requests for %.1f seconds' % retry_after)
+
+
+def is_outage(status):
+    """Whether a response status means that the server failed, as opposed to
+    the request being wrong (like a 404 for a missing issue).
+    """
+    return status >= 500 or status == 429
+
+
+class CircuitBreaker(object):
+    """Tracks the outcome of the requests of the last `window` seconds and
+    opens once at least `minimum_calls` requests were sent and either the
+    share of failures reaches `failure_rate` or the share of requests taking
+    `slow_call_duration` seconds or longer reaches `slow_call_rate`.
+
+    While open, requests fail with `CircuitOpenError`. After `open_duration`
+    seconds the breaker is half-open and lets `half_open_calls` requests
+    through: it closes if they succeed and opens again if one fails.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half-open', 'open'
+
+    def __init__(self, failure_rate=0.5, slow_call_duration=None, slow_call_rate=0.5, minimum_calls=10, window=60,
+                 open_duration=30, half_open_calls=1):
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.minimum_calls = minimum_calls
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        # the number of requests refused while open
+        self.rejected = 0
+        self._state = self.CLOSED
+        self._opened = 0
+        self._probes = 0
+        self._probe_results = 0
+        # (time, failed, slow) of the requests in the window
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._opened + self.open_duration <= time.time():
+                return self.HALF_OPEN
+            return self._state
+
+    def before(self):
+        """Call before sending a request; raises `CircuitOpenError` if it
+        must not be sent.
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self._opened + self.open_duration - time.time()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(remaining)
+                self._state = self.HALF_OPEN
+                self._probes = 0
+                self._probe_results = 0
+            if self._state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    # a probe is in flight
+                    raise CircuitOpenError(1)
+                self._probes += 1
+
+    def record(self, failed, seconds):
+        """Call with the outcome of a request let through by `before`."""
+        slow = self.slow_call_duration is not None and seconds >= self.slow_call_duration
+        now = time.time()
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._probe_results += 1
+                    if self._probe_results >= self.half_open_calls:
+                        self._state = self.CLOSED
+                return
+            if self._state == self.OPEN:
+                # sent before the breaker opened
+                return
+            self._calls.append((now, failed, slow))
+            self._failures += failed
+            self._slow += slow
+            while self._calls and self._calls[0][0] <= now - self.window:
+                old, old_failed, old_slow = self._calls.popleft()
+                self._failures -= old_failed
+                self._slow -= old_slow
+            calls = len(self._calls)
+            if calls >= self.minimum_calls and (self._failures >= self.failure_rate * calls or
+                                                self._slow >= self.slow_call_rate * calls):
+                self._open(now)
+
+    def _open(self, now):
+        self._state = self.OPEN
+        self._opened = now
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+
+class RetryPolicy(object):
+    """Retries requests that failed because the server was unavailable up to
+    `retries` times, waiting a random time between zero and
+    `backoff * 2 ** attempt` seconds (at most `max_backoff`) before each
+    retry, or as long as a Retry-After header asks (also at most
+    `max_backoff`).
+
+    POST requests may have been processed when the response is lost or a
+    gateway fails, so they are only retried if the server refused them (429,
+    503) or the connection could not be established.
+    """
+
+    IDEMPOTENT_STATUSES = (429, 502, 503, 504)
+    STATUSES = (429, 503)
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=10):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def retries_status(self, method, status, attempt):
+        statuses = self.STATUSES if method == 'POST' else self.IDEMPOTENT_STATUSES
+        return attempt < self.retries and status in statuses
+
+    def retries_error(self, method, error, attempt):
+        if attempt >= self.retries:
+            return False
+        if method != 'POST':
+            return isinstance(error, socket.error)
+        return isinstance(error, socket.error) and error.errno == errno.ECONNREFUSED
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
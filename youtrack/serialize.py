@@ -0,0 +1,105 @@
+"""
+Serialization of the XML documents of the import requests, as generators of
+UTF-8 encoded chunks: a document is written in time linear in its size, and
+can be sent while it is written instead of being built in memory first.
+
+The documents are byte for byte those the connection used to build by
+concatenating strings.
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def users_xml(users, known_attrs=('login', 'fullName', 'email', 'jabber')):
+    yield '<list>\n'
+    for u in users:
+        yield _utf8('  <user ' + "".join(k + '=' + quoteattr(u[k]) + ' ' for k in u if k in known_attrs) + '/>\n')
+    yield '</list>'
+
+
+def links_xml(links):
+    yield '<list>\n'
+    for l in links:
+        # ignore typeOutward and typeInward returned by getLinks()
+        yield _utf8('  <link ' + "".join(attr + '=' + quoteattr(l[attr]) + ' '
+                                         for attr in l if attr not in ['typeInward', 'typeOutward']) + '/>\n')
+    yield '</list>'
+
+
+def issues_xml(issues, bad_fields):
+    return records_xml(issue_record(issue, bad_fields) for issue in issues)
+
+
+def records_xml(records):
+    """ Returns the document importing the issues of the given records """
+    yield '<issues>\n'
+    for record in records:
+        yield record
+    yield '</issues>'
+
+
+def issue_record(issue, bad_fields):
+    """ Returns the <issue> element of an issue, leaving out the fields in bad_fields """
+    record = ['  <issue>\n']
+
+    comments = None
+    if getattr(issue, "getComments", None):
+        comments = issue.getComments()
+
+    for issueAttr in issue:
+        attrValue = issue[issueAttr]
+        if attrValue is None:
+            continue
+        if isinstance(attrValue, unicode):
+            attrValue = attrValue.encode('utf-8')
+        if isinstance(issueAttr, unicode):
+            issueAttr = issueAttr.encode('utf-8')
+        if issueAttr == 'comments':
+            comments = attrValue
+        else:
+            # ignore bad fields from getIssue()
+            if issueAttr not in bad_fields:
+                record.append('    <field name="' + issueAttr + '">\n')
+                if isinstance(attrValue, list) or getattr(attrValue, '__iter__', False):
+                    for v in attrValue:
+                        record.append('      <value>' + escape(_utf8(v).strip()) + '</value>\n')
+                else:
+                    record.append('      <value>' + escape(attrValue.strip()) + '</value>\n')
+                record.append('    </field>\n')
+
+    if comments:
+        for comment in comments:
+            record.append('    <comment')
+            for ca in comment:
+                record.append(' ' + _utf8(ca) + '=' + quoteattr(_utf8(comment[ca])))
+            record.append('/>\n')
+
+    record.append('  </issue>\n')
+    return _utf8(''.join(record))
+
+
+def work_items_xml(work_items):
+    yield '<workItems>'
+    for work_item in work_items:
+        item = ['<workItem>',
+                '<date>%s</date>' % work_item.date,
+                '<duration>%s</duration>' % work_item.duration]
+        if hasattr(work_item, 'description') and work_item.description is not None:
+            item.append('<description>%s</description>' % escape(work_item.description))
+        item.append('<author login=%s></author>' % quoteattr(work_item.authorLogin))
+        item.append('</workItem>')
+        yield _utf8(''.join(item))
+    yield '</workItems>'
+
+
+def enum_bundle_xml(name, values):
+    yield '<enumeration name=\"' + _utf8(name) + '\">'
+    for i, v in enumerate(values):
+        yield (' ' if i else '') + '<value>' + _utf8(v) + '</value>'
+    yield '</enumeration>'
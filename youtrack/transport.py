@@ -0,0 +1,201 @@
+"""
+HTTP transport for the YouTrack connection: a thread-safe pool of persistent
+connections.
+"""
+
+import threading
+import time
+import urllib
+from StringIO import StringIO
+import httplib2
+
+
+class HttpPool(object):
+    """A pool of `httplib2.Http` objects shared by all threads.
+
+    Every `Http` object keeps its connections to the server alive, and is used
+    by one request at a time. At most `max_size` requests are sent at once,
+    further callers wait for a free object. Objects that have not been used for
+    `idle_timeout` seconds are closed. `connect_timeout` and `read_timeout`
+    apply to establishing a connection and to waiting for the server's
+    response respectively (`None` means no timeout).
+    """
+
+    # the body of an upload is sent in chunks of about this size
+    UPLOAD_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, max_size=10, idle_timeout=60, connect_timeout=None, read_timeout=None, proxy_info=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.proxy_info = proxy_info
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        """Send a request, returns the `(response, content)` pair of
+        `httplib2.Http.request`.
+        """
+        with self._slots:
+            http = self._checkout()
+            try:
+                result = http.request(uri, method, body=body, headers=headers,
+                                      connection_type=self._connection_type(uri))
+            except Exception:
+                # the connection may be in an undefined state, don't reuse it
+                self._close(http)
+                with self._lock:
+                    self._in_use -= 1
+                raise
+            self._checkin(http)
+            return result
+
+    def stream(self, uri, method='GET', headers=None):
+        """Send a request on a connection of its own and return `(response,
+        body)`, where `body` is a file-like object from which the content can be
+        read while it is downloaded. The caller must close `body`.
+
+        Streams don't take a place in the pool, so that a caller may send
+        further requests while it reads a stream. Through a proxy the content
+        is downloaded completely first.
+        """
+        if self.proxy_info is not None:
+            response, content = self.request(uri, method, headers=headers)
+            return response, StringIO(content)
+        connection, path = self._open(uri)
+        headers = dict(headers or {})
+        headers['Connection'] = 'close'
+        try:
+            connection.request(method, path, headers=headers)
+            body = connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+        return httplib2.Response(body), body
+
+    def upload(self, uri, method, chunks, headers=None):
+        """Send a request whose body is read from the iterable `chunks` while
+        it is sent, with chunked transfer encoding, and return `(response,
+        content)`. The request takes a place in the pool but is sent on a
+        connection of its own. Through a proxy the body is built completely
+        first.
+        """
+        headers = dict(headers or {})
+        if self.proxy_info is not None:
+            body = ''.join(chunks)
+            headers['Content-Length'] = str(len(body))
+            return self.request(uri, method, body, headers)
+        headers['Transfer-Encoding'] = 'chunked'
+        headers['Connection'] = 'close'
+        with self._slots:
+            with self._lock:
+                self._in_use += 1
+            connection, path = self._open(uri)
+            try:
+                connection.putrequest(method, path)
+                for name, value in headers.items():
+                    connection.putheader(name, value)
+                connection.endheaders()
+                for block in _blocks(chunks, self.UPLOAD_BLOCK_SIZE):
+                    connection.send('%x\r\n%s\r\n' % (len(block), block))
+                connection.send('0\r\n\r\n')
+                response = connection.getresponse()
+                content = response.read()
+            finally:
+                connection.close()
+                with self._lock:
+                    self._in_use -= 1
+        return httplib2.Response(response), content
+
+    def in_use(self):
+        """Return the number of requests currently being sent."""
+        return self._in_use
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for last_used, http in idle:
+            self._close(http)
+
+    def _checkout(self):
+        expired = []
+        http = None
+        with self._lock:
+            # the idle list is ordered by last use, the oldest first
+            while self._idle and self._idle[0][0] + self.idle_timeout <= time.time():
+                expired.append(self._idle.pop(0)[1])
+            if self._idle:
+                http = self._idle.pop()[1]
+            self._in_use += 1
+        for old in expired:
+            self._close(old)
+        if http is None:
+            if self.proxy_info is None:
+                http = httplib2.Http(timeout=self.connect_timeout, disable_ssl_certificate_validation=True)
+            else:
+                http = httplib2.Http(timeout=self.connect_timeout, proxy_info=self.proxy_info,
+                                     disable_ssl_certificate_validation=True)
+        return http
+
+    def _checkin(self, http):
+        with self._lock:
+            self._idle.append((time.time(), http))
+            self._in_use -= 1
+
+    def _close(self, http):
+        for connection in http.connections.values():
+            try:
+                connection.close()
+            except Exception:
+                pass
+        http.connections.clear()
+
+    def _open(self, uri):
+        """Return a new connection to the server of `uri` and the path of the
+        request.
+        """
+        scheme, rest = urllib.splittype(uri)
+        host, path = urllib.splithost(rest)
+        options = {'timeout': self.connect_timeout}
+        if scheme == 'https':
+            options['disable_ssl_certificate_validation'] = True
+        return self._connection_type(uri)(host, **options), path
+
+    def _connection_type(self, uri):
+        if uri.startswith('https:'):
+            base = httplib2.HTTPSConnectionWithTimeout
+        else:
+            base = httplib2.HTTPConnectionWithTimeout
+        read_timeout = self.read_timeout
+
+        def connection_type(*args, **kwargs):
+            connection = base(*args, **kwargs)
+            connect = connection.connect
+
+            def connect_with_read_timeout():
+                connect()
+                connection.sock.settimeout(read_timeout)
+            connection.connect = connect_with_read_timeout
+            return connection
+        return connection_type
+
+
+def _blocks(chunks, size):
+    """Join consecutive chunks into blocks of at least `size` bytes, except
+    for the last one, and skip empty ones.
+    """
+    block = []
+    length = 0
+    for chunk in chunks:
+        block.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(block)
+            block = []
+            length = 0
+    if length:
+        yield ''.join(block)
@@ -0,0 +1,33 @@
+"""
+Incremental parsing of the XML lists returned by the YouTrack REST API.
+"""
+
+from xml.dom import minidom
+from xml.etree import cElementTree
+
+
+def iter_elements(stream, tag=None, dom=True):
+    """ Parses an XML document from a file-like object while it is read and yields the direct children of its root
+        element (only those named tag, if given) one at a time, each as a minidom element, so that the existing
+        youtrack objects can be created from it, or as an ElementTree element if dom is False. Only the element
+        being yielded is kept in memory.
+    """
+    depth = 0
+    root = None
+    for event, el in cElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = el
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if tag is None or el.tag == tag:
+            if dom:
+                el.tail = None
+                yield minidom.parseString(cElementTree.tostring(el)).documentElement
+            else:
+                yield el
+        # children are complete at this point and not needed any more
+        root.clear()